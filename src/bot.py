@@ -1,5 +1,8 @@
 #!/usr/bin/env python3.7
 
+import time
+IMPORT_START_TIME = time.perf_counter()
+
 import discord
 from discord.ext import commands
 
@@ -12,6 +15,7 @@ import re
 from enum import Enum
 import argparse
 import asyncio
+import signal
 
 import logging
 from logging.handlers import RotatingFileHandler
@@ -19,11 +23,26 @@ from logging.handlers import RotatingFileHandler
 from typing import Union
 
 import bot_cog
+import storage
+import shared
+from settings import SettingsManager, SettingsError
+from starboard import Route, StarboardRouter, select_for_archive
+
+IMPORT_END_TIME = time.perf_counter()
 
 logger = logging.getLogger('root')
 log_handler = RotatingFileHandler('bot.log', maxBytes=1024*1024*5, backupCount=2)
 logging.basicConfig(level=logging.INFO, handlers=[log_handler, logging.StreamHandler()])
 
+# Seconds between snapshots of volatile state and compactions of the DB journal.
+SNAPSHOT_INTERVAL = 60
+# Seconds to wait for in-flight work to finish when shutting down.
+SHUTDOWN_DRAIN_TIMEOUT = 30
+# Seconds between checks for changes made by other processes in shared mode.
+SHARED_SYNC_INTERVAL = 5
+# Seconds after which an event claim is forgotten. Every process should have received the event by then.
+CLAIM_TTL = 600
+
 ILEE_REGEX = re.compile(r'^[i1lI\|]{2}ee(10+)?$')
 MORNING_REGEX = re.compile(r'(?:^|\W)(morning)(?:$|\W)', re.IGNORECASE)
 
@@ -53,50 +72,116 @@ class Starbot(commands.Bot):
 
         self.guild = None
         self.guild_id = None
+
+        self.settings_manager = None
+        self.starboards = None
+
+        # Cumulative seconds spent reading DB files, for the startup report.
+        self.db_load_time = 0.0
+        self.connect_start_time = None
+        self.has_been_ready = False
+
+        # Namespaces with journaled changes that have not been written to their files yet.
+        self.db_dirty = set()
+        # Tasks doing work that should finish before shutting down.
+        self.pending_work = set()
+        self.shutting_down = False
+
+        # Set when other processes use the same DB directory.
+        self.shared = False
+        self.leader = None
+        self.claims = None
+        # Name of this process among those sharing the directory.
+        self.instance = None
+
+        # Cold storage for each namespace, by namespace name.
+        self.archives = {}
     
-    def run(self, guild_id, *args, **kwargs):
+    def run(self, guild_id, *args, shared_mode=False, instance=None, **kwargs):
         self.guild_id = guild_id
-        self.db = {}
-        for d in Db:
-            self.db_load(d)
+        self.shared = shared_mode
+        self.instance = instance
+        # Namespaces are read from disk the first time they are looked up.
+        if self.shared:
+            self.db = shared.SharedDb(self.db_load_name, self.db_path)
+            self.leader = shared.LeaderElection(f'local/{self.guild_id}/leader.lock')
+            os.makedirs(f'local/{self.guild_id}/leases', exist_ok=True)
+            self.claims = shared.EventClaims(f'local/{self.guild_id}/claims')
+        else:
+            self.db = storage.LazyDb(self.db_load_name)
+        self.db_replay_journal()
+        self.settings_manager = SettingsManager(self, Db.SETTINGS.value)
 
-        self.morning_counter = 0
+        # Volatile state saved by the last run, if any.
+        self.restored_state = storage.read_json_file(self.state_path)
+        self.morning_counter = self.restored_state.get('morning_counter', 0)
 
+        self.connect_start_time = time.perf_counter()
         return super().run(*args, **kwargs)
 
     @property
     def settings(self):
-        return self.db[Db.SETTINGS.value]
+        """ The current settings snapshot. Hold on to it rather than re-reading this within one operation. """
+        return self.settings_manager.current
+
+    def find_channel(self, name):
+        return next(filter(lambda c: c.name == name, self.guild.channels), None)
+
+    def on_settings_changed(self, settings):
+        self.starboards = StarboardRouter(settings, self.find_channel)
+        for name, board_settings in settings.boards.items():
+            if not board_settings.complete:
+                logging.warning(f'Starboard "{name}" needs both an emoji and a channel before it is used.')
+        for board in self.starboards.boards.values():
+            if board.channel is None:
+                logging.error(f'Starboard channel "{board.settings.channel}" not found.')
 
     def cog_db(self, cog_name):
         return bot_cog.CogDb(self, cog_name)
 
-    async def update_starboard_message(self, message: discord.Message):
-        """ Updates or creates a post on the starboard corresponding to a message. """
+    @property
+    def is_leader(self):
+        """ Whether this process should run singleton jobs like awarding points. """
+        return self.leader is None or self.leader.is_leader
+
+    @property
+    def starboard_stats(self):
+        return self.get_cog('StarboardStats')
+
+    async def update_starboard_message(self, message: discord.Message, route: Route):
+        """ Updates or creates a post on a starboard corresponding to a message. """
+        board = route.board
+        settings = board.settings
+        message_map = self.db[board.map_namespace]
+
         # Find the react object corresponding to the starboard emote.
         try:
-            react: discord.Reaction = next(filter(lambda r: str(r.emoji) == self.db[Db.SETTINGS.value]['starboard']['emoji'], message.reactions))
+            react: discord.Reaction = next(filter(lambda r: str(r.emoji) == settings.emoji, message.reactions))
         except StopIteration:
             react = None
 
         # Locate the channel to post to.
-        try:
-            starboard_channel = next(filter(lambda c: c.name == self.db[Db.SETTINGS.value]['starboard']['channel'], self.guild.channels))
-        except StopIteration:
-            logging.error(f'Starboard channel "{self.db[Db.SETTINGS.value]["starboard"]["channel"]}" not found.')
+        starboard_channel = board.channel
+        if starboard_channel is None:
+            logging.error(f'Starboard channel "{settings.channel}" not found.')
             return
      
         message_key = str(message.id)
-
-        logging.debug(f'Processing starboard react for message {message.id}.')
-        if react is not None and react.count >= self.db[Db.SETTINGS.value]['starboard']['threshold']:
+        # Another process may have posted this message already.
+        self.db_sync(board.map_namespace)
+        # The message may have been posted long enough ago to be in cold storage.
+        if message_key not in message_map:
+            await self.restore_starboard_entry(board, message_key)
+
+        logging.debug(f'Processing {board.name} react for message {message.id}.')
+        if react is not None and react.count >= route.threshold:
             # Put a new message on the starboard or edit an old one.
-            logging.debug(f'React above thereshold ({react.count} >= {self.db[Db.SETTINGS.value]["starboard"]["threshold"]}).')
+            logging.debug(f'React above thereshold ({react.count} >= {route.threshold}).')
 
             # Set up the embed.
             embed = discord.Embed()
             embed.description = f'**[Jump]({message.jump_url})**\n{message.content}'
-            embed.set_footer(text=f'{self.db[Db.SETTINGS.value]["starboard"]["emoji"]}{react.count}  | #{message.channel.name}')
+            embed.set_footer(text=f'{settings.emoji}{react.count}  | #{message.channel.name}')
             embed.set_author(name=message.author.display_name,
                                 icon_url=message.author.avatar_url)
             embed.timestamp = message.created_at
@@ -106,83 +191,372 @@ class Starbot(commands.Bot):
                 if attachment.height is not None:
                     embed.set_image(url=attachment.url)
             
-            if message_key not in self.db[Db.MESSAGE_MAP.value]:
+            if message_key not in message_map:
                 logging.debug('Message has not yet been posted to starboard; sending it!')
 
                 sent = await starboard_channel.send(embed=embed)
-                self.db[Db.MESSAGE_MAP.value][message_key] = sent.id
+                self.db_set_key(board.map_namespace, message_key, sent.id)
 
                 logging.debug(f'Message has been posted to the starboard with ID {sent.id}.')
             else:
-                logging.debug(f'Message already exists on starboard with ID {self.db[Db.MESSAGE_MAP.value][message_key]}; editing it.')
+                logging.debug(f'Message already exists on starboard with ID {message_map[message_key]}; editing it.')
 
-                starboard_message = await starboard_channel.fetch_message(self.db[Db.MESSAGE_MAP.value][message_key])
+                starboard_message = await starboard_channel.fetch_message(message_map[message_key])
                 await starboard_message.edit(embed=embed)
-        elif message_key in self.db[Db.MESSAGE_MAP.value]:
+
+            if self.starboard_stats is not None:
+                self.starboard_stats.record(board.name, message, react.count)
+        elif message_key in message_map:
             logging.debug('Reacts fell below threshold. Removing message from starboard.')
             # Message fell below the thereshold.
-            starboard_message = await starboard_channel.fetch_message(self.db[Db.MESSAGE_MAP.value][message_key])
+            starboard_message = await starboard_channel.fetch_message(message_map[message_key])
             await starboard_message.delete()
 
-            del self.db[Db.MESSAGE_MAP.value][message_key]
+            self.db_delete_key(board.map_namespace, message_key)
 
-        self.db_write(Db.MESSAGE_MAP)
+            if self.starboard_stats is not None:
+                self.starboard_stats.remove(board.name, message_key)
 
         logging.debug(f'Done processing react for message {message.id}.')
     
+    async def restore_starboard_entry(self, board, message_key):
+        """ Moves a board's entry for a message back from cold storage, if its post still exists. """
+        archive = self.archive(board.map_namespace)
+        post_id = archive.get(message_key)
+        if post_id is None:
+            return
+        try:
+            await board.channel.fetch_message(post_id)
+        except discord.NotFound:
+            # The post was deleted, so the message is no longer on the board.
+            archive.remove([message_key])
+            if self.starboard_stats is not None:
+                self.starboard_stats.remove(board.name, message_key)
+            return
+        archive.remove([message_key])
+        logging.debug(f'Restored starboard entry for message {message_key} from cold storage.')
+        self.db_set_key(board.map_namespace, message_key, post_id)
+
+    def archive_starboard_entries(self, board, max_age_days=0, max_entries=0):
+        """
+        Moves a board's entries to cold storage if their messages are older than `max_age_days`, then the oldest
+        remaining ones until at most `max_entries` are left. Zero disables either limit. Returns how many were moved.
+        """
+        message_map = self.db[board.map_namespace]
+        archived = {k: message_map[k] for k in select_for_archive(message_map, max_age_days, max_entries)}
+        if len(archived) == 0:
+            return 0
+
+        self.archive(board.map_namespace).append(archived)
+        for k in archived:
+            del message_map[k]
+        self.db_write_name(board.map_namespace)
+        return len(archived)
+
     async def on_ready(self):
         self.guild: discord.Guild = self.get_guild(self.guild_id)
         logging.info(f'Logged in as "{self.user}".')
+        if self.guild is None:
+            logging.error(f'I am not in the server with ID {self.guild_id}. Stopping.')
+            await self.close()
+            return
 
-        from cogs.quick_images import QuickImages
-        self.add_cog(QuickImages(self, logging))
-
-        if 'points_tracker' in self.db[Db.SETTINGS.value] and self.db[Db.SETTINGS.value]['points_tracker']['enabled'] is True:
-            # Start points tracker loop.
-            from cogs.points_tracker import PointsTracker
-            tracker = PointsTracker(self, logging)
-            self.add_cog(tracker)
-
-    async def on_reaction(self, payload):
-        if payload.guild_id != self.guild_id:
+        if not self.has_been_ready:
+            self.has_been_ready = True
+            logging.info(f'Startup timing: import {IMPORT_END_TIME - IMPORT_START_TIME:.3f}s, '
+                         f'load {self.db_load_time:.3f}s, '
+                         f'connect {time.perf_counter() - self.connect_start_time:.3f}s.')
+
+            self.settings_manager.subscribe(self.on_settings_changed)
+            asyncio.create_task(self.settings_manager.watch())
+
+            if self.settings.db_prefetch is True:
+                asyncio.create_task(self.db_prefetch())
+
+            asyncio.create_task(self.snapshot_loop())
+            if self.shared:
+                asyncio.create_task(self.leader.campaign())
+                asyncio.create_task(self.db_sync_loop())
+            asyncio.create_task(self.delete_stale_prompts())
+            try:
+                asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(self.shutdown()))
+            except NotImplementedError:
+                # Signal handlers are not available on Windows.
+                pass
+
+            # Cogs are only added once, since several of them start loops that keep running across reconnects.
+            from cogs.paginator import Paginators
+            self.add_cog(Paginators(self))
+
+            from cogs.quick_images import QuickImages
+            self.add_cog(QuickImages(self, logging))
+
+            from cogs.starboard_stats import StarboardStats
+            self.add_cog(StarboardStats(self, logging))
+
+            from cogs.memory_monitor import MemoryMonitor
+            self.add_cog(MemoryMonitor(self))
+
+            if self.settings.points_tracker.enabled is True:
+                # Start points tracker loop.
+                from cogs.points_tracker import PointsTracker
+                tracker = PointsTracker(self, logging)
+                self.add_cog(tracker)
+        else:
+            # The guild object may have been replaced while we were disconnected.
+            self.settings_manager.refresh()
+
+    async def on_guild_channel_create(self, channel):
+        self.settings_manager.refresh()
+    async def on_guild_channel_delete(self, channel):
+        self.settings_manager.refresh()
+    async def on_guild_channel_update(self, before, after):
+        self.settings_manager.refresh()
+
+    async def on_reaction(self, payload, routes, claim):
+        if payload.guild_id != self.guild_id or len(routes) == 0 or self.shutting_down:
+            return
+        # Claimed last, so that a claimed event is always handled.
+        if not claim():
             return
+        await self.run_outbound(self.update_starboard_messages(payload, routes))
+
+    async def update_starboard_messages(self, payload, routes):
+        if self.shared:
+            # Only one process may update a message's posts at a time, from fetching the reaction counts to saving
+            #  the post, or two could both see no post and create one each.
+            async with shared.KeyLease(f'local/{self.guild_id}/leases/{payload.message_id}.lock'):
+                await self.fetch_and_update_starboard_messages(payload, routes)
+        else:
+            await self.fetch_and_update_starboard_messages(payload, routes)
+
+    async def fetch_and_update_starboard_messages(self, payload, routes):
         message = await self.guild.get_channel(payload.channel_id).fetch_message(payload.message_id)
-        await self.update_starboard_message(message)
+        for route in routes:
+            await self.update_starboard_message(message, route)
+
+    def claim_event(self, key, state=None):
+        """
+        Whether this process should handle an event, which is always the case unless other processes share the DB.
+        Events that alternate between two states pass the state they are in.
+        """
+        if self.claims is None:
+            return True
+        return self.claims.claim(key) if state is None else self.claims.claim_toggle(key, state)
+
+    def claim_reaction(self, payload, state):
+        emoji = payload.emoji.id or '-'.join(f'{ord(c):x}' for c in payload.emoji.name)
+        return self.claim_event(f'reaction.{payload.message_id}.{payload.user_id}.{emoji}', state)
 
     async def on_raw_reaction_add(self, payload):
-        await self.on_reaction(payload)
+        route = self.starboards.route(str(payload.emoji), payload.channel_id)
+        await self.on_reaction(payload, [route] if route is not None else [], lambda: self.claim_reaction(payload, 'add'))
     async def on_raw_reaction_remove(self, payload):
-        await self.on_reaction(payload)
+        route = self.starboards.route(str(payload.emoji), payload.channel_id)
+        await self.on_reaction(payload, [route] if route is not None else [], lambda: self.claim_reaction(payload, 'remove'))
     async def on_raw_reaction_clear(self, payload):
-        await self.on_reaction(payload)
+        # Clearing has no emoji, so only boards the message is already on need to be updated.
+        routes = [r for r in self.starboards.routes_for_channel(payload.channel_id)
+                  if str(payload.message_id) in self.db[r.board.map_namespace]
+                  or str(payload.message_id) in self.archive(r.board.map_namespace)]
+        await self.on_reaction(payload, routes, lambda: self.claim_event(f'clear.{payload.message_id}'))
 
     async def on_command_error(self, ctx, error):
         if type(error) is DifferentServerCheckFail:
             return
         return await super().on_command_error(ctx, error)
     
+    def db_path(self, db_file):
+        return f'local/{self.guild_id}/{db_file}.json'
+
+    def db_read_name_versioned(self, db_file):
+        """ Reads a DB file from disk without storing it in `self.db`, along with the version of the file read. """
+        start = time.perf_counter()
+        data, version = storage.read_json_file_versioned(self.db_path(db_file))
+        self.db_load_time += time.perf_counter() - start
+        return data, version
+
+    def db_read_name(self, db_file):
+        return self.db_read_name_versioned(db_file)[0]
+
     # TODO Replace `db_load` with this.
     def db_load_name(self, db_file):
-        path = f'local/{self.guild_id}/{db_file}.json'
-        if not os.path.exists(path):
-            self.db[db_file] = {}
-        else:
-            with open(path, 'r', encoding='utf-8') as file:
-                self.db[db_file] = json.load(file)
+        if db_file in self.db_dirty:
+            # Re-reading the file would throw away changes that have not been written yet.
+            return self.db[db_file]
+        self.db.set_loaded(db_file, *self.db_read_name_versioned(db_file))
         return self.db[db_file]
 
     def db_load(self, db_file):
         return self.db_load_name(db_file.value)
 
+    def db_write_file(self, db_file):
+        path = self.db_path(db_file)
+        logging.info(f'Writing to "{path}".')
+        if self.shared:
+            # Merges in changes from other processes under a lock.
+            self.db.write(db_file)
+        else:
+            storage.write_json_atomic(path, self.db[db_file])
+
     def db_write_name(self, db_file):
-        path = f'local/{self.guild_id}/{db_file}.json'
-        with open(path, 'w+', encoding='utf-8') as file:
-            logging.info(f'Writing to "{path}".')
-            json.dump(self.db[db_file], file)
+        self.db_write_file(db_file)
+
+        if db_file in self.db_dirty:
+            # The file now contains every journaled change to this namespace.
+            self.journal.append({'ns': db_file, 'op': 'written'})
+            self.db_dirty.discard(db_file)
     
     def db_write(self, db_file):
         return self.db_write_name(db_file.value)
 
+    def db_set_key(self, db_file, key, value):
+        """ Sets a single key in a namespace, journaling the change instead of rewriting the whole file. """
+        self.db[db_file][key] = value
+        if self.shared:
+            # The journal belongs to one process, so shared namespaces are written straight through.
+            self.db_write_file(db_file)
+            return
+        self.journal.append({'ns': db_file, 'op': 'set', 'key': key, 'value': value})
+        self.db_dirty.add(db_file)
+
+    def db_delete_key(self, db_file, key):
+        """ Deletes a single key from a namespace, journaling the change instead of rewriting the whole file. """
+        del self.db[db_file][key]
+        if self.shared:
+            self.db_write_file(db_file)
+            return
+        self.journal.append({'ns': db_file, 'op': 'delete', 'key': key})
+        self.db_dirty.add(db_file)
+
+    def db_mark_dirty(self, db_file):
+        """
+        Marks a namespace as changed in memory so that it is written at the next compaction, for changes that do not
+        fit the journal's key-level records. They are lost if the process dies before then.
+        """
+        self.db_dirty.add(db_file)
+
+    def db_compact(self):
+        """ Writes every namespace with journaled changes to its file and empties the journal. """
+        for db_file in list(self.db_dirty):
+            self.db_write_file(db_file)
+        self.db_dirty.clear()
+        self.journal.truncate()
+
+    def db_replay_journal(self):
+        """ Applies changes left in the journal by the last run, then compacts it. """
+        self.journal = storage.Journal(f'local/{self.guild_id}/journal.jsonl')
+        pending = self.journal.read()
+        for db_file, records in pending.items():
+            logging.info(f'Replaying {len(records)} journaled changes to "{db_file}".')
+            storage.apply_journal_records(self.db[db_file], records)
+            self.db_dirty.add(db_file)
+        self.db_compact()
+
+    async def db_prefetch(self):
+        """ Loads any namespaces that have not been accessed yet, reading the files off the event loop. """
+        loop = asyncio.get_running_loop()
+        for d in Db:
+            if self.db.is_loaded(d.value):
+                continue
+            data, version = await loop.run_in_executor(None, self.db_read_name_versioned, d.value)
+            # The namespace may have been loaded by a command while we were reading it.
+            if not self.db.is_loaded(d.value):
+                self.db.set_loaded(d.value, data, version)
+        logging.info('Finished prefetching DB namespaces.')
+
+    def db_register_counters(self, db_file, paths):
+        """
+        Marks the keys at `paths` in a namespace as counters, so that in shared mode increments made by different
+        processes are added together instead of one overwriting the other. `*` in a path matches any key.
+        """
+        if self.shared:
+            self.db.counters[db_file] = paths
+
+    def db_sync(self, db_file):
+        """ In shared mode, picks up changes other processes have made to a namespace. """
+        if self.shared:
+            self.db.sync(db_file)
+
+    async def db_sync_loop(self):
+        while True:
+            await asyncio.sleep(SHARED_SYNC_INTERVAL)
+            for db_file in list(self.db.keys()):
+                self.db_sync(db_file)
+
+    def archive_path(self, db_file):
+        return f'local/{self.guild_id}/archive/{db_file}.jsonl'
+
+    def archive(self, db_file):
+        """ The cold storage for a namespace. Its index is kept between lookups, so keep using the same one. """
+        if db_file not in self.archives:
+            self.archives[db_file] = storage.Archive(self.archive_path(db_file))
+        return self.archives[db_file]
+
+    @property
+    def state_path(self):
+        # Processes sharing a directory each keep their own volatile state.
+        if self.shared:
+            return f'local/{self.guild_id}/state.{self.instance}.json'
+        return f'local/{self.guild_id}/state.json'
+
+    def snapshot_state(self):
+        """ Saves runtime state that is not kept in the DB, so that it survives a restart. """
+        from cogs.react_prompt import pending_prompt_ids
+        state = {
+            'morning_counter': self.morning_counter,
+            'cogs': { name: cog.snapshot_state() for name, cog in self.cogs.items() if isinstance(cog, bot_cog.StarbotCog) },
+            'prompts': pending_prompt_ids()
+        }
+        storage.write_json_atomic(self.state_path, state)
+
+    async def snapshot_loop(self):
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            try:
+                self.snapshot_state()
+                self.db_compact()
+                if self.claims is not None and self.is_leader:
+                    self.claims.expire(CLAIM_TTL)
+            except Exception:
+                # Keep snapshotting; the next attempt may succeed.
+                logging.exception('Failed to snapshot state.')
+
+    async def delete_stale_prompts(self):
+        """ Deletes react prompts that were still waiting for a response when the last run ended. """
+        for channel_id, message_id in self.restored_state.get('prompts', []):
+            channel = self.guild.get_channel(channel_id)
+            try:
+                message = await channel.fetch_message(message_id)
+                await message.delete()
+            except (discord.HTTPException, AttributeError):
+                continue
+
+    async def run_outbound(self, coro):
+        """
+        Runs a coroutine as work that shutting down should wait for. It gets a task of its own, so that only the work
+        itself is waited for and not whatever long-running task started it.
+        """
+        task = asyncio.create_task(coro)
+        self.pending_work.add(task)
+        task.add_done_callback(self.pending_work.discard)
+        return await task
+
+    async def shutdown(self):
+        """ Stops taking new work, waits for in-flight work to finish, saves all state and disconnects. """
+        if self.shutting_down:
+            return
+        self.shutting_down = True
+        logging.info('Shutting down.')
+
+        if len(self.pending_work) > 0:
+            logging.info(f'Waiting for {len(self.pending_work)} tasks to finish.')
+            await asyncio.wait(set(self.pending_work), timeout=SHUTDOWN_DRAIN_TIMEOUT)
+
+        self.snapshot_state()
+        self.db_compact()
+        await self.close()
+
     @staticmethod
     def name_lock_help_message():
         return "Please register your name with `image_name_lock` first."
@@ -194,6 +568,18 @@ class Starbot(commands.Bot):
         except StopIteration:
             return None
     
+parser = argparse.ArgumentParser()
+parser.add_argument('server', help='name of the server in `servers.json`')
+parser.add_argument('--shared', action='store_true',
+                    help='share the server\'s DB directory with other running processes')
+parser.add_argument('--instance',
+                    help='with --shared, a name for this process that stays the same across restarts')
+args = parser.parse_args()
+# The bot only serves one guild, which always lives on a single shard, so discord.py's sharding options are not
+#  offered. Processes sharing a directory split the work by claiming events instead.
+if args.shared and args.instance is None:
+    parser.error('--shared needs --instance')
+
 bot = Starbot()
 
 @bot.check
@@ -205,21 +591,36 @@ def check_guild(ctx):
 
 @bot.command()
 async def delete_starred(ctx, message_id):
-    try:
-        starboard_channel = next(filter(lambda c: c.name == bot.db[Db.SETTINGS.value]['starboard']['channel'], bot.guild.channels))
-    except StopIteration:
-        logging.error(f'Starboard channel "{bot.db[Db.SETTINGS.value]["starboard"]["channel"]}" not found.')
-        return
+    """
+    Delete a post from whichever starboard it is on, given the ID of the post.
+    """
+    message_id = int(message_id)
+
+    for board in bot.starboards.boards.values():
+        message_map = bot.db[board.map_namespace]
+        keys = [k for k, v in message_map.items() if v == message_id]
+        archive = bot.archive(board.map_namespace)
+        archived_keys = [k for k, v in archive.items() if v == message_id]
+        if len(keys) == 0 and len(archived_keys) == 0:
+            continue
+
+        if board.channel is None:
+            logging.error(f'Starboard channel "{board.settings.channel}" not found.')
+            return
 
-    starboard_message = await starboard_channel.fetch_message(int(message_id))
-    await starboard_message.delete()
+        starboard_message = await board.channel.fetch_message(message_id)
+        await starboard_message.delete()
 
-    new_map = {}
-    for k in bot.message_map:
-        if bot.message_map[k] != int(message_id):
-            new_map[k] = bot.message_map[k] 
-    bot.message_map = new_map
-    bot.db_write(Db.MESSAGE_MAP)
+        for k in keys:
+            del message_map[k]
+        archive.remove(archived_keys)
+        if bot.starboard_stats is not None:
+            for k in keys + archived_keys:
+                bot.starboard_stats.remove(board.name, k)
+        bot.db_write_name(board.map_namespace)
+        return
+
+    await ctx.send('That message is not on any starboard.')
 
 @bot.command()
 async def hi(ctx):
@@ -278,6 +679,19 @@ async def opinion(ctx, name, *args):
 
     await ctx.send(bot.db[Db.OPINIONS.value][name])
 
+@bot.command(aliases=['ol'])
+async def opinion_list(ctx):
+    """
+    List every name I have an opinion about, along with the opinion.
+    """
+    from cogs.paginator import send_paginated
+
+    def lines():
+        for name, opinion in bot.db[Db.OPINIONS.value].items():
+            yield f'{name}: {opinion}'
+
+    await send_paginated(bot, ctx, lines, count=len(bot.db[Db.OPINIONS.value]))
+
 @bot.command(aliases=['ilock'])
 async def image_name_lock(ctx, name):
     """
@@ -309,12 +723,14 @@ async def image_list_names(ctx):
     """
     Print a list of all names and a count of the images owned by them.
     """
-    out = "```\n"
+    from cogs.paginator import send_paginated
 
-    for name, image_list in items(bot.db[Db.NAME_LOCKS.value]):
-        out += f'{name} | {len(image_list)}\n'
-         
-    return out + "```"
+    def lines():
+        images = bot.db[Db.QUICK_IMAGES.value]
+        for name in bot.db[Db.NAME_LOCKS.value]:
+            yield f'{name} | {len(images.get(name, []))}'
+
+    await send_paginated(bot, ctx, lines, count=len(bot.db[Db.NAME_LOCKS.value]))
 
 @bot.command(aliases=['ia'])
 async def image_add(ctx, *args):
@@ -426,23 +842,20 @@ async def image_dump(ctx, *args):
         await ctx.send('There are no images to dump.')
         return
 
-    text = f'```\nName: {name}\n=====================\n'
-    
-    for i, image in enumerate(bot.db[Db.QUICK_IMAGES.value][name]):
-        line = f' {i+1:>3} {image}\n'
-        if len(text) >= 2000 - len(line) - len('```'):
-            await ctx.send(text + '```')
-            text = '```\n'
-        text += line
-    
-    if len(text.strip()) > 0:
-        await ctx.send(text.strip() + '```')
+    from cogs.paginator import send_paginated
+
+    def lines():
+        for i, image in enumerate(bot.db[Db.QUICK_IMAGES.value].get(name, [])):
+            yield f' {i+1:>3} {image}'
+
+    await send_paginated(bot, ctx, lines, header=f'Name: {name}\n=====================',
+                         count=len(bot.db[Db.QUICK_IMAGES.value][name]))
 
 @bot.command(aliases=['s'])
 async def setting(ctx, *args):
     if len(args) == 0:
         # Just print the settings.
-        await ctx.send(f'My current settings are:\n```json\n{json.dumps(bot.db[Db.SETTINGS.value], indent=4)}\n```')
+        await ctx.send(f'My current settings are:\n```json\n{json.dumps(bot.settings.to_dict(), indent=4, ensure_ascii=False)}\n```')
         return
     
     # Otherwise set one.
@@ -450,26 +863,14 @@ async def setting(ctx, *args):
         await ctx.send(f'This takes two arguments; you gave me {len(args)}.' )
         return
     
-    # Descend into the settings object by each `.` in the argument.
-    splitter = args[0].split('.')
-    settings_domain = bot.db[Db.SETTINGS.value]
-    while len(splitter) > 1:
-        settings_domain = settings_domain[splitter[0]]
-        splitter = splitter[1:]
-
-    if splitter[0] not in settings_domain:
-        await ctx.send(f'I do not have a setting called "{args[0]}".')
-        return
-
+    # The settings manager validates the new value and swaps in a new snapshot.
     try:
-        cur_type = type(settings_domain[splitter[0]])
-        settings_domain[splitter[0]] = (cur_type)(args[-1])
-        await ctx.send(f'Done! `{args[0]}` has been set to `{args[-1]}`.')
-    except TypeError:
-        await ctx.send(f'I was unable to convert "{args[-1]}" to the right type.')
+        bot.settings_manager.set(args[0], args[-1])
+    except SettingsError as e:
+        await ctx.send(f'I was unable to set `{args[0]}`: {e}')
         return
-    
-    bot.db_write(Db.SETTINGS)
+
+    await ctx.send(f'Done! `{args[0]}` has been set to `{args[-1]}`.')
 
 @bot.command()
 async def txt(ctx):
@@ -511,8 +912,11 @@ async def on_message(message):
         if bot.morning_counter == 5:
             bot.morning_counter = 0
             await message.channel.send('Morning') 
-    await morning_counter(message)  
-    await bot.process_commands(message)
+    # Every process sharing the DB sees every message, so only the leader keeps count.
+    if bot.is_leader:
+        await morning_counter(message)
+    if message.content.startswith(bot.command_prefix) and bot.claim_event(f'message.{message.id}'):
+        await bot.process_commands(message)
 
 if not os.path.exists('servers.json'):
     print('Servers file not found. Please make a file called `severs.json` and put the server names as keys and their IDs as values.', file=sys.stderr)
@@ -524,8 +928,8 @@ if not os.path.exists('token.txt'):
 
 with open('token.txt', 'r') as token_file, open('servers.json', 'r') as servers_file:
     servers = json.load(servers_file)
-    if sys.argv[1] not in servers:
-        print(f'Server "{sys.argv[1]}" not found. Aborting.', file=sys.stderr)
+    if args.server not in servers:
+        print(f'Server "{args.server}" not found. Aborting.', file=sys.stderr)
         sys.exit(1)
 
     if not os.path.exists('token.txt'):
@@ -534,8 +938,8 @@ with open('token.txt', 'r') as token_file, open('servers.json', 'r') as servers_
 
     with open('token.txt', 'r') as token_file, open('servers.json', 'r') as servers_file:
         servers = json.load(servers_file)
-        if sys.argv[1] not in servers:
-            print(f'Server "{sys.argv[1]}" not found. Aborting.', file=sys.stderr)
+        if args.server not in servers:
+            print(f'Server "{args.server}" not found. Aborting.', file=sys.stderr)
             sys.exit(1)
 
-        bot.run(int(servers[sys.argv[1]]), token_file.read())
+        bot.run(int(servers[args.server]), token_file.read(), shared_mode=args.shared, instance=args.instance)
@@ -1,5 +1,6 @@
 from discord.ext import commands
 
+import storage
 from bot import Starbot
 from bot import logging
 
@@ -19,14 +20,25 @@ class StarbotCog(commands.Cog):
     def __init__(self, bot: Starbot, default_config):
         self.bot = bot
         with self.cog_db() as db:
-            for key in default_config:
-                if key not in db or type(db[key]) is not type(default_config[key]):
-                    logging.info(f'Updating "{key}" in DB to default value ("{default_config[key]}")')
-                    db[key] = default_config[key]
+            for key in storage.fill_defaults(db, default_config):
+                logging.info(f'Updating "{key}" in DB to default value ("{default_config[key]}")')
+
+    @property
+    def cog_db_name(self):
+        return 'cog__' + type(self).__name__
+
+    @property
+    def restored_state(self):
+        """ The state this cog returned from `snapshot_state` in the last run, if any. """
+        return self.bot.restored_state.get('cogs', {}).get(type(self).__name__, {})
+
+    def snapshot_state(self):
+        """ Return runtime state to save across restarts. It must be JSON serializable. """
+        return {}
 
     def cog_db(self):
-        return self.bot.cog_db('cog__' + type(self).__name__)
+        return self.bot.cog_db(self.cog_db_name)
 
     @property
     def cog_db_ro(self):
-        return self.bot.db['cog__' + type(self).__name__]
+        return self.bot.db[self.cog_db_name]
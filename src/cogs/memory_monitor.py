@@ -0,0 +1,190 @@
+# Module for keeping an eye on the bot's memory use.
+#
+# The `memory` command reports the approximate size of every loaded DB namespace and of the larger in-memory
+#  caches, and can take `tracemalloc` snapshots on demand. On an interval, the retention policies and budgets
+#  from the `memory` settings are applied so that the largest structures stop growing without bound.
+
+import asyncio
+import sys
+import tracemalloc
+
+from discord.ext import commands
+
+from bot import logging
+
+TRACE_TOP_COUNT = 10
+
+def approximate_size(obj, seen=None) -> int:
+    """ The approximate number of bytes used by an object and everything it contains. """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approximate_size(k, seen) + approximate_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(item, seen) for item in obj)
+    return size
+
+def format_size(size) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GiB'
+
+class MemoryMonitor(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.launch_loop()
+
+    def namespace_sizes(self):
+        """ The number of entries and approximate size of each loaded namespace, without loading any others. """
+        return {name: (len(data), approximate_size(data)) for name, data in list(self.bot.db.items())}
+
+    def cache_sizes(self):
+        """ The approximate size of each in-memory cache that is not part of the DB. """
+        from cogs.react_prompt import pending_prompts
+
+        caches = {}
+        stats = self.bot.starboard_stats
+        if stats is not None:
+            caches['starboard stats rankings'] = [r.heap for rankings in stats.rankings.values() for r in rankings]
+        paginators = self.bot.get_cog('Paginators')
+        if paginators is not None:
+            caches['paginators'] = paginators.active
+        if self.bot.starboards is not None:
+            caches['starboard routes'] = self.bot.starboards.table
+        caches['react prompts'] = pending_prompts
+        caches['journaled namespaces'] = self.bot.db_dirty
+        caches['cold storage indexes'] = [archive.index for archive in self.bot.archives.values()]
+
+        return {name: (len(cache), approximate_size(cache)) for name, cache in caches.items()}
+
+    def over_budget(self, sizes):
+        budgets = self.bot.settings.memory.namespace_budgets_kb
+        return [name for name, (_, size) in sizes.items() if name in budgets and size > budgets[name] * 1024]
+
+    def enforce_budget(self, name, ratio):
+        """
+        Move the oldest entries of a namespace to cold storage, keeping about `ratio` of them. Returns how many were
+        moved, or None if the namespace has no entries that can be moved.
+        """
+        boards = {board.map_namespace: board for board in self.bot.starboards.boards.values()}
+        stats = self.bot.starboard_stats
+        tracker = self.bot.get_cog('PointsTracker')
+
+        if name in boards:
+            keep = int(len(self.bot.db[name]) * ratio)
+            # A limit of 0 means no limit, so keep at least one entry.
+            return self.bot.archive_starboard_entries(boards[name], max_entries=max(1, keep))
+        if stats is not None and name == stats.cog_db_name:
+            largest = max((len(data['counts']) for data in stats.cog_db_ro['boards'].values()), default=0)
+            return stats.archive_entries(max_entries=max(1, int(largest * ratio)))
+        if tracker is not None and name == tracker.cog_db_name:
+            return tracker.archive_oldest(int(len(tracker.cog_db_ro['members']) * ratio))
+        return None
+
+    def apply_retention(self):
+        """ Move old entries out of memory according to the `memory` settings. """
+        settings = self.bot.settings.memory
+
+        if settings.message_map_retention_days > 0 or settings.message_map_max_entries > 0:
+            for board in self.bot.starboards.boards.values():
+                count = self.bot.archive_starboard_entries(board, settings.message_map_retention_days,
+                                                           settings.message_map_max_entries)
+                if count > 0:
+                    logging.info(f'Moved {count} {board.name} entries to cold storage.')
+
+            stats = self.bot.starboard_stats
+            if stats is not None:
+                count = stats.archive_entries(settings.message_map_retention_days, settings.message_map_max_entries)
+                if count > 0:
+                    logging.info(f'Moved {count} starboard statistics entries to cold storage.')
+
+        tracker = self.bot.get_cog('PointsTracker')
+        if settings.points_inactive_days > 0 and tracker is not None:
+            count = tracker.archive_inactive(settings.points_inactive_days)
+            if count > 0:
+                logging.info(f'Moved {count} inactive points tracker members to cold storage.')
+
+        sizes = self.namespace_sizes()
+        for name in self.over_budget(sizes):
+            # Entries are taken to be about the same size, so keep the share of them that fits in the budget.
+            ratio = settings.namespace_budgets_kb[name] * 1024 / sizes[name][1]
+            count = self.enforce_budget(name, ratio)
+            if count is None:
+                logging.warning(f'DB namespace "{name}" is over its memory budget, but none of it can be moved to '
+                                'cold storage.')
+            elif count > 0:
+                logging.info(f'Moved {count} entries of "{name}" to cold storage to keep it within its budget.')
+
+        for name, archive in self.bot.archives.items():
+            if archive.needs_compaction:
+                logging.info(f'Compacting cold storage for "{name}".')
+                archive.compact()
+
+    async def retention_loop(self):
+        while True:
+            await asyncio.sleep(self.bot.settings.memory.check_interval)
+            # Only one process applies retention when several share the DB.
+            if self.bot.is_leader and not self.bot.shutting_down:
+                self.apply_retention()
+
+    def launch_loop(self):
+        asyncio.create_task(self.retention_loop())
+
+    @commands.group(invoke_without_command=True)
+    async def memory(self, ctx):
+        """
+        Show the approximate memory used by each loaded DB namespace and cache.
+        """
+        namespaces = self.namespace_sizes()
+        over_budget = self.over_budget(namespaces)
+
+        message = '```\n'
+        message += f'{"Namespace":<32} {"Entries":>8} {"Size":>12}\n'
+        for name, (count, size) in sorted(namespaces.items(), key=lambda n: n[1][1], reverse=True):
+            marker = ' (over budget)' if name in over_budget else ''
+            message += f'{name:<32} {count:>8} {format_size(size):>12}{marker}\n'
+        message += f'\n{"Cache":<32} {"Entries":>8} {"Size":>12}\n'
+        for name, (count, size) in self.cache_sizes().items():
+            message += f'{name:<32} {count:>8} {format_size(size):>12}\n'
+        message += '```'
+        await ctx.send(message)
+
+    @memory.command(name='trace')
+    async def memory_trace(self, ctx):
+        """
+        Start tracing allocations, or show where the most memory has been allocated since tracing started.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            await ctx.send('Started tracing allocations. Run this again to see where memory is going.')
+            return
+
+        stats = tracemalloc.take_snapshot().statistics('lineno')[:TRACE_TOP_COUNT]
+        message = '```\n'
+        for stat in stats:
+            frame = stat.traceback[0]
+            message += f'{format_size(stat.size):>12} {frame.filename.split("/")[-1]}:{frame.lineno}\n'
+        message += '```'
+        await ctx.send(message)
+
+    @memory.command(name='untrace')
+    async def memory_untrace(self, ctx):
+        """ Stop tracing allocations. """
+        tracemalloc.stop()
+        await ctx.send('Stopped tracing allocations.')
+
+    @memory.command(name='compact')
+    async def memory_compact(self, ctx):
+        """ Apply the retention policies now instead of waiting for the next check. """
+        if not self.bot.is_leader:
+            await ctx.send('Another process is running background jobs, so it has to do this.')
+            return
+        self.apply_retention()
+        await ctx.send('Done.')
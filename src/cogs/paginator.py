@@ -0,0 +1,137 @@
+# Paged output for long lists.
+#
+# Rather than sending a long list as a flood of messages, a paginated list is sent as a single message that
+#  is edited as users flip through it with reactions. Pages are rendered on demand from a function that
+#  returns a fresh iterator over the list's lines, so only the page being shown is ever built.
+
+import asyncio
+import itertools
+import time
+
+import discord
+from discord.ext import commands
+
+from bot import logging
+
+from typing import Callable, Iterable, Optional
+
+PAGE_SIZE = 15
+# Seconds without a page turn after which a paginator stops responding.
+PAGINATOR_TIMEOUT = 300
+MESSAGE_LIMIT = 2000
+
+PREVIOUS_PAGE = '◀️'
+NEXT_PAGE = '▶️'
+
+class Paginator:
+    def __init__(self, source: Callable[[], Iterable[str]], header: str = '', count: Optional[int] = None,
+                 page_size: int = PAGE_SIZE, code_block: bool = True):
+        """
+        `source` is called to get a new iterator over the lines each time a page is rendered. `count` is the total
+        number of lines, if it is known. Pages are shown in a code block unless `code_block` is False, e.g. so that
+        links in them can be clicked.
+        """
+        self.source = source
+        self.header = header
+        self.count = count
+        self.page_size = page_size
+        self.code_block = code_block
+        self.page = 0
+        self.message = None
+        self.last_used = time.monotonic()
+
+    @property
+    def page_count(self):
+        if self.count is None:
+            return None
+        return max(1, -(-self.count // self.page_size))
+
+    def render(self) -> Optional[str]:
+        """ Build the text of the current page, or None if it is past the end of the list. """
+        start = self.page * self.page_size
+        lines = list(itertools.islice(self.source(), start, start + self.page_size))
+        if len(lines) == 0 and self.page > 0:
+            return None
+
+        footer = f'Page {self.page + 1}' + (f'/{self.page_count}' if self.page_count is not None else '')
+        body = '\n'.join(lines)
+        if self.header:
+            body = self.header + '\n' + body
+
+        # Leave room for the code block and footer.
+        limit = MESSAGE_LIMIT - len(footer) - (len('```\n\n```\n') if self.code_block else len('\n'))
+        if len(body) > limit:
+            body = body[:limit - 1] + '…'
+        if not self.code_block:
+            return f'{body}\n{footer}'
+        return f'```\n{body}\n```\n{footer}'
+
+    def turn(self, delta) -> Optional[str]:
+        """ Move by `delta` pages and render the new page, or return None and stay put if there is no such page. """
+        old_page = self.page
+        self.page = max(0, self.page + delta)
+        if self.page == old_page:
+            return None
+
+        text = self.render()
+        if text is None:
+            self.page = old_page
+            return None
+
+        self.last_used = time.monotonic()
+        return text
+
+class Paginators(commands.Cog):
+    """ Tracks the paginated messages that are still accepting page turns. """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.active = {}
+
+    async def send(self, destination: discord.abc.Messageable, paginator: Paginator):
+        """ Send the first page of a paginator, and let users turn pages if there is more than one. """
+        text = paginator.render()
+        paginator.message = await destination.send(text)
+
+        if paginator.page_count == 1:
+            return
+
+        self.active[paginator.message.id] = paginator
+        for react in (PREVIOUS_PAGE, NEXT_PAGE):
+            await paginator.message.add_reaction(react)
+        asyncio.create_task(self.expire(paginator))
+
+    async def expire(self, paginator: Paginator):
+        while time.monotonic() - paginator.last_used < PAGINATOR_TIMEOUT:
+            await asyncio.sleep(PAGINATOR_TIMEOUT - (time.monotonic() - paginator.last_used))
+
+        del self.active[paginator.message.id]
+        try:
+            await paginator.message.clear_reactions()
+        except discord.HTTPException:
+            pass
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload):
+        if payload.message_id not in self.active or payload.user_id == self.bot.user.id:
+            return
+        paginator = self.active[payload.message_id]
+
+        emoji = str(payload.emoji)
+        if emoji not in (PREVIOUS_PAGE, NEXT_PAGE):
+            return
+
+        text = paginator.turn(-1 if emoji == PREVIOUS_PAGE else 1)
+        if text is not None:
+            await paginator.message.edit(content=text)
+
+        # Remove the reaction so the same button can be pressed again.
+        try:
+            await paginator.message.remove_reaction(payload.emoji, discord.Object(payload.user_id))
+        except discord.HTTPException:
+            logging.debug('Unable to remove page turn reaction.')
+
+async def send_paginated(bot: commands.Bot, destination: discord.abc.Messageable, source: Callable[[], Iterable[str]],
+                         header: str = '', count: Optional[int] = None, code_block: bool = True):
+    """ Send a list of lines as a single message whose pages can be flipped through with reactions. """
+    await bot.get_cog('Paginators').send(destination, Paginator(source, header, count, code_block=code_block))
@@ -18,6 +18,7 @@ from dataclasses import dataclass
 import discord.abc
 
 import bot_cog
+from cogs.paginator import send_paginated
 
 BURY_RESEND_THRESHOLD = 3
 
@@ -25,11 +26,15 @@ LEAVE_SCOREBOARD_TIME = timedelta(minutes=2)
 
 logging = None
 
-async def run_on_interval(interval, func):
-    import time
+async def run_on_interval(interval, func, delay=0):
+    """
+    Call `func` repeatedly, starting after `delay` seconds. `interval` is a function returning the number of
+    seconds to wait in between.
+    """
+    await asyncio.sleep(delay)
     while True:
         await func()
-        await asyncio.sleep(interval)
+        await asyncio.sleep(interval())
 
 @dataclass
 class UserPointsInfo:
@@ -50,23 +55,31 @@ class PointsTracker(bot_cog.StarbotCog):
         global logging
         logging = parent_logging
 
-        super().__init__(bot, { 'members': dict(), 'scoreboard_message_id': None })
+        super().__init__(bot, { 'members': dict(), 'scoreboard_message_id': None, 'last_tick': None })
+
+        self.bury_count = self.restored_state.get('bury_count', 0)
+        self.is_hibernating = self.restored_state.get('is_hibernating', True)
+
+        self.settings = None
+        self.output_channel = None
+        self.bot.settings_manager.subscribe(self.on_settings_changed)
+
         self.launch_loop()
 
+    def on_settings_changed(self, settings):
+        self.settings = settings.points_tracker
+        self.output_channel = self.bot.find_channel(self.settings.channel)
+        if self.output_channel is None:
+            logging.warning('Unable to find output channel for points message.')
+
+    def snapshot_state(self):
+        return { 'bury_count': self.bury_count, 'is_hibernating': self.is_hibernating }
+
     @commands.Cog.listener()
     async def on_message(self, message):
-        if message.channel.name == self.bot.settings['points_tracker']['channel'] and message.author != self.bot.user:
+        if message.channel.name == self.settings.channel and message.author != self.bot.user:
             self.bury_count += 1
 
-    @property
-    def output_channel(self):
-        try:
-            output_channel = next(filter(lambda c: c.name == self.bot.settings['points_tracker']['channel'], self.bot.guild.channels))
-            return output_channel
-        except StopIteration:
-            logging.warning('Unable to find output channel for points message.')
-            return None
-
     def scoreboard_message(self, present_users):
         """ Generate the contents of the scoreboard message. """
         message = 'Points have been awarded to those in the voice chat!\n'
@@ -94,7 +107,54 @@ class PointsTracker(bot_cog.StarbotCog):
         message += '```'
         return message
 
+    def archive_inactive(self, days):
+        """ Move members who have not gained points in `days` days to cold storage. Returns how many were moved. """
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        with self.cog_db() as db:
+            inactive = {k: v for k, v in db['members'].items() if datetime.fromisoformat(v['last_gained']) < cutoff}
+            if len(inactive) == 0:
+                return 0
+            self.bot.archive(self.cog_db_name).append(inactive)
+            for k in inactive:
+                del db['members'][k]
+        return len(inactive)
+
+    def archive_oldest(self, keep):
+        """ Move all but the `keep` most recently active members to cold storage. Returns how many were moved. """
+        with self.cog_db() as db:
+            members = sorted(db['members'], key=lambda k: datetime.fromisoformat(db['members'][k]['last_gained']))
+            oldest = {k: db['members'][k] for k in members[:max(0, len(members) - keep)]}
+            if len(oldest) == 0:
+                return 0
+            self.bot.archive(self.cog_db_name).append(oldest)
+            for k in oldest:
+                del db['members'][k]
+        return len(oldest)
+
+    @commands.command(aliases=['lb'])
+    async def leaderboard(self, ctx):
+        """ List everyone who has gained points, highest score first. """
+        # Members moved to cold storage for inactivity keep their points, so they are ranked too.
+        archive = self.bot.archive(self.cog_db_name)
+        count = len(self.cog_db_ro['members']) + len(archive)
+
+        def lines():
+            members = list(self.cog_db_ro['members'].items()) + list(archive.items())
+            members.sort(key=lambda m: m[1]['score'], reverse=True)
+            for rank, (member_id, score_info) in enumerate(members):
+                member = self.bot.get_user(int(member_id))
+                name = member.display_name if member is not None else member_id
+                yield f'{rank + 1:>3} {name:>32} | {score_info["score"]}'
+
+        await send_paginated(self.bot, ctx, lines, count=count)
+
     async def handle_points(self):
+        # Only one process awards points when several share the DB.
+        if self.bot.shutting_down or not self.bot.is_leader:
+            return
+        await self.bot.run_outbound(self.award_points())
+
+    async def award_points(self):
         logging.info('Checking for VC users to give points to')
         members = []
         for vc in self.bot.guild.voice_channels:
@@ -111,12 +171,26 @@ class PointsTracker(bot_cog.StarbotCog):
         self.is_hibernating = False
 
         with self.cog_db() as db:
+            # A previous leader may have awarded points just before we took over.
+            if db['last_tick'] is not None:
+                since_tick = datetime.utcnow() - datetime.fromisoformat(db['last_tick'])
+                if since_tick.total_seconds() < self.settings.interval / 2:
+                    return
+
             for member in members:
                 if str(member.id) not in db['members']:
-                    logging.info(f'Adding user {member.id} to scoreboard')
-                    db['members'][str(member.id)] = UserPointsInfo(datetime.utcnow(), 0).json_vars()
+                    archived = self.bot.archive(self.cog_db_name).get(str(member.id))
+                    if archived is not None:
+                        logging.info(f'Restoring user {member.id} to scoreboard from cold storage')
+                        db['members'][str(member.id)] = archived
+                        self.bot.archive(self.cog_db_name).remove([str(member.id)])
+                    else:
+                        logging.info(f'Adding user {member.id} to scoreboard')
+                        db['members'][str(member.id)] = UserPointsInfo(datetime.utcnow(), 0).json_vars()
                 db['members'][str(member.id)]['score'] += 1
                 db['members'][str(member.id)]['last_gained'] = str(datetime.utcnow())
+            # Saved with the scores so a restart can tell that this tick already happened.
+            db['last_tick'] = str(datetime.utcnow())
 
         if self.output_channel is not None:
             with self.cog_db() as db:
@@ -132,4 +206,9 @@ class PointsTracker(bot_cog.StarbotCog):
                     await message.edit(content=self.scoreboard_message(members))
 
     def launch_loop(self):
-        asyncio.create_task(run_on_interval(180, self.handle_points))
+        # Wait out the rest of the interval if points were awarded shortly before a restart.
+        delay = 0
+        if self.cog_db_ro['last_tick'] is not None:
+            since_tick = datetime.utcnow() - datetime.fromisoformat(self.cog_db_ro['last_tick'])
+            delay = max(0, self.settings.interval - since_tick.total_seconds())
+        asyncio.create_task(run_on_interval(lambda: self.settings.interval, self.handle_points, delay))
@@ -18,7 +18,15 @@ class ReactPromptPreset(Enum):
 
     YES_NO = {'\U0001F44D': 'yes', '\U0001F44E': 'no'}
 
+# Prompts that are waiting for a response, by message ID.
+pending_prompts = {}
+
+def pending_prompt_ids():
+    """ The channel and message IDs of every prompt still waiting for a response. """
+    return [[p.message.channel.id, p.message.id] for p in pending_prompts.values()]
+
 async def on_prompt_reacted(prompt, bot, response:str, future):
+    pending_prompts.pop(prompt.message.id, None)
     await prompt.message.delete()
     bot.remove_cog(prompt)
     
@@ -40,6 +48,7 @@ async def react_prompt_response(bot, user, message, preset:ReactPromptPreset=Non
 
     prompt = ReactPrompt(bot, user, message, reacts, lambda response: on_prompt_reacted(prompt, bot, response, future))
     bot.add_cog(prompt)
+    pending_prompts[message.id] = prompt
 
     for react in reacts:
         await prompt.message.add_reaction(react)
@@ -0,0 +1,299 @@
+# Module for keeping running statistics about the starboards.
+#
+# Aggregates are updated as starboard entries are created, updated and removed, so the `starstats`
+#  commands can answer from them instead of scanning channel history. Each board keeps the star count of
+#  every message on it, star totals per author and net stars gained per day. They are stored in the cog's
+#  DB and can be rebuilt from the boards' message maps with `starstats rebuild`. Per-message counts are moved
+#  to cold storage along with the boards' message maps, while the totals are always kept.
+
+import heapq
+import re
+
+import discord
+from discord.ext import commands
+
+from datetime import datetime, timedelta
+
+import bot_cog
+from cogs.paginator import send_paginated
+from settings import DEFAULT_BOARD
+from starboard import select_for_archive
+
+JUMP_URL_REGEX = re.compile(r'/channels/\d+/(\d+)/(\d+)')
+
+# Totals that several processes may add to at once.
+COUNTER_PATHS = [('boards', '*', 'authors', '*'), ('boards', '*', 'days', '*')]
+
+# The most rows any `starstats` listing will show.
+MAX_TOP = 100
+MAX_DAYS = 366
+
+logging = None
+
+class RankedScores:
+    """
+    Positive scores by key, with a lazily pruned max-heap alongside them so the top `k` can be read without
+    sorting every key. The `scores` dict is kept up to date in place, so it can be shared with the DB.
+    """
+
+    def __init__(self, scores: dict):
+        self.scores = scores
+        self.heap = [(-score, key) for key, score in scores.items()]
+        heapq.heapify(self.heap)
+
+    def set(self, key, score):
+        if score <= 0:
+            self.scores.pop(key, None)
+        else:
+            self.scores[key] = score
+            heapq.heappush(self.heap, (-score, key))
+
+        # Old entries are left in the heap when a score changes; drop them once they dominate it.
+        if len(self.heap) > 2 * len(self.scores) + 64:
+            self.heap = [(-score, key) for key, score in self.scores.items()]
+            heapq.heapify(self.heap)
+
+    def add(self, key, delta):
+        self.set(key, self.scores.get(key, 0) + delta)
+
+    def top(self, k):
+        """ The `k` highest scoring keys as `(key, score)` pairs, highest first. """
+        result = []
+        seen = set()
+        while len(self.heap) > 0 and len(result) < k:
+            neg_score, key = heapq.heappop(self.heap)
+            if self.scores.get(key) != -neg_score or key in seen:
+                # Stale or duplicate entry.
+                continue
+            seen.add(key)
+            result.append((key, -neg_score))
+        for key, score in result:
+            heapq.heappush(self.heap, (-score, key))
+        return result
+
+class StarboardStats(bot_cog.StarbotCog):
+    def __init__(self, bot, parent_logging):
+        global logging
+        logging = parent_logging
+
+        super().__init__(bot, { 'boards': dict() })
+        self.rankings = {}
+        self.bot.db_register_counters(self.cog_db_name, COUNTER_PATHS)
+
+    def board_data(self, board_name):
+        boards = self.cog_db_ro['boards']
+        if board_name not in boards:
+            boards[board_name] = { 'counts': dict(), 'entries': dict(), 'authors': dict(), 'days': dict() }
+        return boards[board_name]
+
+    def board_rankings(self, board_name):
+        """ The ranked message counts and author totals for a board. """
+        data = self.board_data(board_name)
+        # The data is replaced when another process's changes are merged in, so check that it is still ours.
+        if board_name not in self.rankings or self.rankings[board_name][0].scores is not data['counts']:
+            self.rankings[board_name] = (RankedScores(data['counts']), RankedScores(data['authors']))
+        return self.rankings[board_name]
+
+    def write(self):
+        self.bot.db_write_name(self.cog_db_name)
+
+    @property
+    def archive(self):
+        # Keyed by `{board}/{message ID}`.
+        return self.bot.archive(self.cog_db_name)
+
+    def restore_entry(self, board_name, key):
+        """ Move a message's count back from cold storage, so that changes to it are counted from the right total. """
+        archived = self.archive.get(f'{board_name}/{key}')
+        if archived is None:
+            return
+        data = self.board_data(board_name)
+        messages, _ = self.board_rankings(board_name)
+        messages.set(key, archived['count'])
+        data['entries'][key] = archived['entry']
+        self.archive.remove([f'{board_name}/{key}'])
+
+    def archive_entries(self, max_age_days=0, max_entries=0):
+        """
+        Move per-message counts to cold storage under the same limits as the boards' message maps. The highest
+        ranked messages and all totals stay, so the `starstats` listings are unaffected. Returns how many were moved.
+        """
+        archived = {}
+        for board_name, data in self.cog_db_ro['boards'].items():
+            messages, _ = self.board_rankings(board_name)
+            top = set(key for key, _ in messages.top(MAX_TOP))
+            candidates = [key for key in data['counts'] if key not in top]
+            for key in select_for_archive(candidates, max_age_days, max_entries):
+                archived[f'{board_name}/{key}'] = { 'count': data['counts'][key], 'entry': data['entries'][key] }
+
+        if len(archived) == 0:
+            return 0
+
+        self.archive.append(archived)
+        for archive_key in archived:
+            board_name, key = archive_key.split('/')
+            messages, _ = self.board_rankings(board_name)
+            messages.set(key, 0)
+            del self.board_data(board_name)['entries'][key]
+        self.write()
+        return len(archived)
+
+    def mark_dirty(self):
+        # Statistics change on every reaction, so they are written with the next compaction rather than each time.
+        #  Anything lost in a crash can be recovered with `starstats rebuild`.
+        self.bot.db_mark_dirty(self.cog_db_name)
+
+    def record(self, board_name, message: discord.Message, count, day=None):
+        """ Record that a message is on a board with `count` stars. """
+        data = self.board_data(board_name)
+        messages, authors = self.board_rankings(board_name)
+        key = str(message.id)
+
+        if key not in data['counts']:
+            self.restore_entry(board_name, key)
+        delta = count - data['counts'].get(key, 0)
+        if delta == 0:
+            return
+
+        messages.set(key, count)
+        data['entries'][key] = [str(message.author.id), str(message.channel.id)]
+        authors.add(str(message.author.id), delta)
+
+        day = str(day or datetime.utcnow().date())
+        data['days'][day] = data['days'].get(day, 0) + delta
+
+        self.mark_dirty()
+
+    def remove(self, board_name, message_id):
+        """ Record that a message is no longer on a board. """
+        data = self.board_data(board_name)
+        messages, authors = self.board_rankings(board_name)
+        key = str(message_id)
+
+        if key not in data['counts']:
+            self.restore_entry(board_name, key)
+        if key not in data['counts']:
+            return
+
+        count = data['counts'][key]
+        author_id, _ = data['entries'].pop(key)
+        messages.set(key, 0)
+        authors.add(author_id, -count)
+
+        day = str(datetime.utcnow().date())
+        data['days'][day] = data['days'].get(day, 0) - count
+
+        self.mark_dirty()
+
+    async def find_board(self, ctx, board):
+        """
+        Look up a board's statistics for a command that only reads them. Unlike `board_data`, this never adds a board,
+        so a mistyped name is not saved. Replies and returns None for the data if there are no statistics.
+        """
+        name = DEFAULT_BOARD if board is None else board
+        data = self.cog_db_ro['boards'].get(name)
+        if data is None:
+            known = self.bot.starboards is not None and name in self.bot.starboards.boards
+            await ctx.send(f'There is nothing on {name} yet.' if known else f'I do not have a board called "{name}".')
+        return name, data
+
+    @commands.group(invoke_without_command=True)
+    async def starstats(self, ctx):
+        """
+        Show statistics about the starboards. See the subcommands for what is available.
+        """
+        await ctx.send_help(ctx.command)
+
+    @starstats.command(name='authors')
+    async def starstats_authors(self, ctx, count: int = 10, board=None):
+        """ List the authors with the most stars on a board, up to 100. """
+        board, data = await self.find_board(ctx, board)
+        if data is None:
+            return
+        _, authors = self.board_rankings(board)
+        if len(authors.scores) == 0:
+            await ctx.send(f'There is nothing on {board} yet.')
+            return
+
+        lines = []
+        for author_id, score in authors.top(min(count, MAX_TOP)):
+            user = self.bot.get_user(int(author_id))
+            name = user.display_name if user is not None else author_id
+            lines.append(f'{name:>40} | {score}')
+        await send_paginated(self.bot, ctx, lambda: iter(lines), count=len(lines))
+
+    @starstats.command(name='messages')
+    async def starstats_messages(self, ctx, count: int = 10, board=None):
+        """ List the messages with the most stars on a board, up to 100. """
+        board, data = await self.find_board(ctx, board)
+        if data is None:
+            return
+        messages, _ = self.board_rankings(board)
+
+        lines = []
+        for message_id, score in messages.top(min(count, MAX_TOP)):
+            _, channel_id = data['entries'][message_id]
+            lines.append(f'{score:>4} https://discord.com/channels/{self.bot.guild_id}/{channel_id}/{message_id}')
+        if len(lines) == 0:
+            await ctx.send(f'There is nothing on {board} yet.')
+            return
+        # Leave the links clickable.
+        await send_paginated(self.bot, ctx, lambda: iter(lines), count=len(lines), code_block=False)
+
+    @starstats.command(name='velocity')
+    async def starstats_velocity(self, ctx, days: int = 7, board=None):
+        """ Show the net number of stars gained on a board on each of the last few days, up to a year. """
+        board, data = await self.find_board(ctx, board)
+        if data is None:
+            return
+        today = datetime.utcnow().date()
+
+        days = max(1, min(days, MAX_DAYS))
+
+        def lines():
+            for i in range(days):
+                day = str(today - timedelta(days=i))
+                yield f'{day} | {data["days"].get(day, 0)}'
+
+        await send_paginated(self.bot, ctx, lines, count=days)
+
+    @starstats.command(name='rebuild')
+    async def starstats_rebuild(self, ctx):
+        """
+        Rebuild the statistics from the boards' message maps, including entries in cold storage. Stars are
+        counted on the day the original message was posted, since the history of when they were added is not
+        available.
+        """
+        if not self.bot.is_leader:
+            await ctx.send('Another process is running background jobs, so it has to do the rebuild.')
+            return
+
+        await ctx.send('Rebuilding starboard statistics. This may take a while.')
+
+        self.cog_db_ro['boards'] = dict()
+        self.rankings = {}
+        self.archive.clear()
+
+        for board in self.bot.starboards.boards.values():
+            if board.channel is None:
+                continue
+            self.board_data(board.name)
+            # Entries moved to cold storage are still on the board.
+            entries = list(self.bot.db[board.map_namespace].items())
+            entries += list(self.bot.archive(board.map_namespace).items())
+            for message_key, post_id in entries:
+                try:
+                    post = await board.channel.fetch_message(post_id)
+                    match = JUMP_URL_REGEX.search(post.embeds[0].description)
+                    channel = self.bot.guild.get_channel(int(match.group(1)))
+                    message = await channel.fetch_message(int(message_key))
+                except (discord.HTTPException, AttributeError, IndexError, TypeError):
+                    logging.warning(f'Unable to find starboard post {post_id} for message {message_key}; skipping it.')
+                    continue
+
+                react = next(filter(lambda r: str(r.emoji) == board.settings.emoji, message.reactions), None)
+                if react is not None:
+                    self.record(board.name, message, react.count, day=message.created_at.date())
+
+        self.write()
+        await ctx.send('Done rebuilding starboard statistics.')
@@ -0,0 +1,277 @@
+# Typed view of the `settings` database.
+#
+# The raw settings are still stored as JSON through the bot's DB layer, but hot paths read them through
+#  immutable snapshot objects built here. A snapshot is only ever replaced as a whole, after the new values
+#  have been validated, and subscribers are notified so they can recompute anything derived from it.
+
+import asyncio
+import collections.abc
+import copy
+import logging
+import os
+import re
+
+from dataclasses import dataclass, field, fields, is_dataclass
+from types import MappingProxyType
+from typing import Callable, List, Mapping, Tuple
+
+class SettingsError(ValueError):
+    pass
+
+_TRUE_STRINGS = ('true', 'yes', 'on', '1')
+_FALSE_STRINGS = ('false', 'no', 'off', '0')
+
+# Name of the board configured by the top-level `starboard` setting.
+DEFAULT_BOARD = 'starboard'
+# Board names become part of DB file names, so they are limited to characters that are safe in a path.
+BOARD_NAME_REGEX = re.compile(r'[a-z0-9_-]+')
+
+def _empty_mapping():
+    return MappingProxyType({})
+
+@dataclass(frozen=True)
+class StarboardSettings:
+    emoji: str = '⭐'
+    channel: str = 'starboard'
+    threshold: int = 5
+    # Per-source-channel thresholds, keyed by channel name.
+    channel_thresholds: Mapping[str, int] = field(default_factory=_empty_mapping)
+    # Names of source channels whose messages never go to this board.
+    excluded_channels: Tuple[str, ...] = ()
+
+    def __post_init__(self):
+        if self.threshold < 1 or any(t < 1 for t in self.channel_thresholds.values()):
+            raise SettingsError('starboard thresholds must be at least 1')
+
+    @property
+    def complete(self) -> bool:
+        """ Whether the board has both an emoji and a channel, and so can be posted to. """
+        return self.emoji != '' and self.channel != ''
+
+@dataclass(frozen=True)
+class ExtraStarboardSettings(StarboardSettings):
+    """
+    An additional board. These have no default emoji or channel, so that a board is not routed anywhere until
+    both have been set.
+    """
+    emoji: str = ''
+    channel: str = ''
+
+@dataclass(frozen=True)
+class PointsTrackerSettings:
+    enabled: bool = False
+    channel: str = 'points'
+    interval: int = 180
+
+    def __post_init__(self):
+        if self.interval < 1:
+            raise SettingsError('"points_tracker.interval" must be at least 1')
+
+@dataclass(frozen=True)
+class MemorySettings:
+    # Starboard entries for messages older than this many days are moved to cold storage, along with their
+    #  per-message statistics. 0 keeps them all.
+    message_map_retention_days: int = 0
+    # The most entries each starboard and its statistics keep in memory; the oldest are moved to cold storage.
+    #  0 means no limit.
+    message_map_max_entries: int = 0
+    # Points tracker members who have not gained points in this many days are moved to cold storage. 0 keeps them.
+    points_inactive_days: int = 0
+    # Approximate size budgets in kilobytes, by DB namespace. When a starboard's message map, the starboard
+    #  statistics or the points tracker's members go over budget, their oldest entries are moved to cold storage.
+    #  Other namespaces over budget are only logged and reported.
+    namespace_budgets_kb: Mapping[str, int] = field(default_factory=_empty_mapping)
+    # Seconds between retention checks.
+    check_interval: int = 3600
+
+    def __post_init__(self):
+        if min(self.message_map_retention_days, self.message_map_max_entries, self.points_inactive_days) < 0:
+            raise SettingsError('memory retention limits cannot be negative')
+        if self.check_interval < 1:
+            raise SettingsError('"memory.check_interval" must be at least 1')
+
+@dataclass(frozen=True)
+class Settings:
+    starboard: StarboardSettings = field(default_factory=StarboardSettings)
+    # Additional boards, keyed by name.
+    starboards: Mapping[str, ExtraStarboardSettings] = field(default_factory=_empty_mapping)
+    points_tracker: PointsTrackerSettings = field(default_factory=PointsTrackerSettings)
+    memory: MemorySettings = field(default_factory=MemorySettings)
+    db_prefetch: bool = False
+
+    def __post_init__(self):
+        if DEFAULT_BOARD in self.starboards:
+            raise SettingsError(f'"starboards.{DEFAULT_BOARD}" is reserved; use the "starboard" setting instead')
+        for name in self.starboards:
+            if not BOARD_NAME_REGEX.fullmatch(name):
+                raise SettingsError(f'"{name}" is not a valid board name; use only a-z, 0-9, "_" and "-"')
+        emojis = [board.emoji for board in self.boards.values() if board.emoji != '']
+        if len(emojis) != len(set(emojis)):
+            raise SettingsError('each starboard must use a different emoji')
+
+    @property
+    def boards(self) -> Mapping[str, StarboardSettings]:
+        """ Every configured board by name, including the default one. """
+        return {DEFAULT_BOARD: self.starboard, **self.starboards}
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> 'Settings':
+        """ Build a snapshot from raw settings, raising `SettingsError` if they do not fit the schema. """
+        return _build(cls, raw, '')
+
+    def to_dict(self) -> dict:
+        return _to_json(self)
+
+def _origin(tp):
+    return getattr(tp, '__origin__', None)
+
+def _check_type(expected, value, path):
+    # `bool` is a subclass of `int`, so it has to be excluded explicitly.
+    if type(value) is bool and expected is not bool:
+        raise SettingsError(f'"{path}" must be of type {expected.__name__}')
+    if not isinstance(value, expected):
+        raise SettingsError(f'"{path}" must be of type {expected.__name__}')
+    return value
+
+def _convert(tp, value, path):
+    if is_dataclass(tp):
+        return _build(tp, value, path)
+    if _origin(tp) is collections.abc.Mapping:
+        if not isinstance(value, dict):
+            raise SettingsError(f'"{path}" must be an object')
+        return MappingProxyType({k: _convert(tp.__args__[1], v, f'{path}.{k}') for k, v in value.items()})
+    if _origin(tp) is tuple:
+        if not isinstance(value, (list, tuple)):
+            raise SettingsError(f'"{path}" must be a list')
+        return tuple(_convert(tp.__args__[0], v, f'{path}.{i}') for i, v in enumerate(value))
+    return _check_type(tp, value, path)
+
+def _build(cls, raw, path):
+    if not isinstance(raw, dict):
+        raise SettingsError(f'"{path}" must be an object')
+
+    values = {}
+    for f in fields(cls):
+        if f.name not in raw:
+            continue
+        key = f'{path}.{f.name}' if path else f.name
+        values[f.name] = _convert(f.type, raw[f.name], key)
+    return cls(**values)
+
+def _to_json(value):
+    if is_dataclass(value):
+        return {f.name: _to_json(getattr(value, f.name)) for f in fields(value)}
+    if isinstance(value, collections.abc.Mapping):
+        return {k: _to_json(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_to_json(v) for v in value]
+    return value
+
+def setting_type(path: str):
+    """ Get the type of the setting at a dotted path, or None if there is no such setting. """
+    tp = Settings
+    for part in path.split('.'):
+        if is_dataclass(tp):
+            matching = [f for f in fields(tp) if f.name == part]
+            if len(matching) == 0:
+                return None
+            tp = matching[0].type
+        elif _origin(tp) is collections.abc.Mapping:
+            # Any key may be added to a mapping.
+            tp = tp.__args__[1]
+        else:
+            return None
+    return None if is_dataclass(tp) or _origin(tp) is collections.abc.Mapping else tp
+
+def coerce(expected, text: str):
+    """ Convert user input to a setting's type. Lists are given as comma-separated values. """
+    if _origin(expected) is tuple:
+        return tuple(coerce(expected.__args__[0], item.strip()) for item in text.split(',') if item.strip() != '')
+    if expected is bool:
+        if text.lower() in _TRUE_STRINGS:
+            return True
+        if text.lower() in _FALSE_STRINGS:
+            return False
+        raise SettingsError(f'"{text}" is not a boolean')
+    try:
+        return expected(text)
+    except ValueError:
+        raise SettingsError(f'"{text}" is not of type {expected.__name__}')
+
+class SettingsManager:
+    """ Owns the current settings snapshot and swaps it when the settings change. """
+
+    def __init__(self, bot, namespace='settings'):
+        self.bot = bot
+        self.namespace = namespace
+        self.subscribers: List[Callable[[Settings], None]] = []
+        try:
+            self.current = Settings.from_dict(self.bot.db[self.namespace])
+        except SettingsError as e:
+            # The file is left alone, so it can still be fixed by hand or with the `setting` command.
+            logging.error(f'Invalid settings file; using the defaults until it is fixed: {e}')
+            self.current = Settings()
+        self.mtime = self._file_mtime()
+        self.watching = False
+
+    def subscribe(self, callback: Callable[[Settings], None]):
+        """ Call `callback` with the current snapshot now and with each new snapshot after it is swapped in. """
+        self.subscribers.append(callback)
+        callback(self.current)
+
+    def _file_mtime(self):
+        path = self.bot.db_path(self.namespace)
+        return os.path.getmtime(path) if os.path.exists(path) else None
+
+    def refresh(self):
+        """ Notify subscribers again without changing the snapshot, e.g. after the guild's channels change. """
+        for callback in self.subscribers:
+            try:
+                callback(self.current)
+            except Exception:
+                logging.exception('Settings subscriber failed.')
+
+    def _swap(self, raw: dict, snapshot: Settings):
+        self.bot.db[self.namespace] = raw
+        self.current = snapshot
+        self.refresh()
+
+    def set(self, path: str, text: str):
+        """ Set a setting from user input and persist it. Raises `SettingsError` if it is invalid. """
+        expected = setting_type(path)
+        if expected is None:
+            raise SettingsError(f'I do not have a setting called "{path}".')
+
+        raw = copy.deepcopy(self.bot.db[self.namespace])
+        domain = raw
+        parts = path.split('.')
+        for part in parts[:-1]:
+            domain = domain.setdefault(part, {})
+        domain[parts[-1]] = coerce(expected, text)
+
+        snapshot = Settings.from_dict(raw)
+        self._swap(raw, snapshot)
+        self.bot.db_write_name(self.namespace)
+        self.mtime = self._file_mtime()
+
+    def reload(self):
+        """ Re-read the settings file, keeping the old snapshot if the new contents are invalid. """
+        self.mtime = self._file_mtime()
+        try:
+            raw = self.bot.db_read_name(self.namespace)
+            snapshot = Settings.from_dict(raw)
+        except ValueError as e:
+            logging.error(f'Ignoring invalid settings file: {e}')
+            return
+        logging.info('Settings file changed on disk; reloading.')
+        self._swap(raw, snapshot)
+
+    async def watch(self, interval=5):
+        """ Poll the settings file and reload it whenever it changes on disk. """
+        if self.watching:
+            return
+        self.watching = True
+        while True:
+            await asyncio.sleep(interval)
+            if self._file_mtime() != self.mtime:
+                self.reload()
@@ -0,0 +1,285 @@
+# Support for running several bot processes against the same `local/{guild_id}` directory.
+#
+# Each process keeps its own copy of the namespaces it has loaded. Writes are made under a per-namespace file
+#  lock, and if another process has written the file since our copy was read, the two are merged key by key
+#  before writing: keys we changed take our value, and every other key takes the value on disk. Objects changed
+#  on both sides are merged the same way, a level down, and counters registered with `SharedDb.counters` add up
+#  the changes made on each side. Jobs that must only run once at a time are gated on
+#  `LeaderElection`. Every process receives every gateway event, so `EventClaims` decides which one handles each
+#  command and reaction.
+
+import asyncio
+import copy
+import logging
+import os
+import time
+
+from typing import Callable, Dict, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # File locks are only available on POSIX systems.
+    fcntl = None
+
+import storage
+
+def file_version(path: str):
+    """ Something that changes whenever a file written with `storage.write_json_atomic` is replaced. """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_ino, stat.st_mtime_ns]
+
+def _is_counter(path: Tuple[str, ...], counters: Sequence[Tuple[str, ...]]) -> bool:
+    return any(len(pattern) == len(path) and all(p in ('*', k) for p, k in zip(pattern, path)) for pattern in counters)
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def merge_keys(base: dict, ours: dict, theirs: dict, counters: Sequence[Tuple[str, ...]] = (),
+               path: Tuple[str, ...] = ()) -> dict:
+    """
+    Apply the keys changed between `base` and `ours` on top of `theirs`. Where both sides have an object under a key
+    we changed, the objects are merged recursively, so changes to different keys inside them are both kept.
+
+    `counters` are paths of keys, where `*` matches any key, holding numbers that are added to rather than set. The
+    change we made to one is added to the value on disk, so increments made on both sides are all kept. A missing
+    counter counts as 0, and a counter that ends up at 0 is left out.
+    """
+    merged = dict(theirs)
+    for key in set(ours) | set(base):
+        key_path = path + (key,)
+        values = (base.get(key, 0), ours.get(key, 0), theirs.get(key, 0))
+        if _is_counter(key_path, counters) and all(_is_number(v) for v in values):
+            base_value, our_value, their_value = values
+            total = their_value + our_value - base_value
+            if total == 0:
+                merged.pop(key, None)
+            else:
+                merged[key] = total
+        elif key not in ours:
+            # We deleted it.
+            merged.pop(key, None)
+        elif key in base and ours[key] == base[key]:
+            continue
+        elif isinstance(ours[key], dict) and isinstance(theirs.get(key), dict):
+            key_base = base.get(key)
+            merged[key] = merge_keys(key_base if isinstance(key_base, dict) else {}, ours[key], theirs[key],
+                                     counters, key_path)
+        else:
+            merged[key] = ours[key]
+    return merged
+
+class FileLock:
+    """ An exclusive lock on a file, held for the duration of a `with` block. """
+
+    def __init__(self, path: str):
+        if fcntl is None:
+            raise RuntimeError('shared mode requires POSIX file locks')
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        self.file.close()
+        self.file = None
+
+class KeyLease:
+    """
+    An exclusive lock on a single key that can be held across awaits, e.g. while a message is being posted. Waiting
+    for it polls rather than blocking the event loop. It is a file lock, so the operating system releases it if the
+    holder dies, and it also keeps concurrent tasks within one process apart.
+    """
+
+    def __init__(self, path: str, interval=0.1):
+        if fcntl is None:
+            raise RuntimeError('shared mode requires POSIX file locks')
+        self.path = path
+        self.interval = interval
+        self.file = None
+
+    def try_acquire(self) -> bool:
+        file = open(self.path, 'a')
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+
+        # The last holder removes the file when it is done, so we may have locked a file that is already gone.
+        try:
+            current = os.stat(self.path).st_ino == os.fstat(file.fileno()).st_ino
+        except FileNotFoundError:
+            current = False
+        if not current:
+            file.close()
+            return False
+
+        self.file = file
+        return True
+
+    def release(self):
+        # Remove the file while still holding it, so that lease files do not pile up.
+        os.remove(self.path)
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        self.file.close()
+        self.file = None
+
+    async def __aenter__(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.interval)
+        return self
+
+    async def __aexit__(self, *args):
+        self.release()
+
+class EventClaims:
+    """
+    Makes sure each gateway event is handled by one process, since every process receives all of them. The first
+    process to create an event's claim file handles it. Claims are removed by `expire` once no process could still
+    be receiving the event.
+    """
+
+    def __init__(self, directory: str):
+        if fcntl is None:
+            raise RuntimeError('shared mode requires POSIX file locks')
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def claim(self, key: str) -> bool:
+        """ Claim an event that only happens once, such as a message being sent. Returns whether we got it. """
+        try:
+            os.close(os.open(os.path.join(self.directory, key), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        return True
+
+    def claim_toggle(self, key: str, state: str) -> bool:
+        """
+        Claim an event that alternates between two states, such as one user adding and removing the same reaction
+        on a message. Another event in the state claimed last is the same event received by another process, while
+        one in the other state is new. Returns whether we got it.
+        """
+        with open(os.path.join(self.directory, key), 'a+') as file:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            file.seek(0)
+            if file.read() == state:
+                return False
+            file.seek(0)
+            file.truncate()
+            file.write(state)
+            return True
+
+    def expire(self, max_age):
+        """ Remove claims made more than `max_age` seconds ago. """
+        cutoff = time.time() - max_age
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # Another process expired it first.
+                continue
+
+class SharedDb(storage.LazyDb):
+    """
+    A `LazyDb` whose files may also be written by other processes. It remembers what each namespace looked like on
+    disk when it was last read or written, so changes made by other processes can be merged in rather than lost.
+    """
+
+    def __init__(self, loader: Callable[[str], object], path_for: Callable[[str], str]):
+        super().__init__(loader)
+        self.path_for = path_for
+        self.versions = {}
+        self.bases = {}
+        # Paths of counters in each namespace, for `merge_keys`.
+        self.counters: Dict[str, Sequence[Tuple[str, ...]]] = {}
+
+    def set_loaded(self, key, data, version):
+        super().set_loaded(key, data, version)
+        self.versions[key] = version
+        self.bases[key] = copy.deepcopy(data)
+
+    def sync(self, key):
+        """ Merge changes written by other processes into our copy of a namespace, keeping our unwritten changes. """
+        if not self.is_loaded(key):
+            return
+        path = self.path_for(key)
+        if file_version(path) == self.versions.get(key):
+            return
+
+        theirs, version = storage.read_json_file_versioned(path)
+        ours = dict.__getitem__(self, key)
+        merged = merge_keys(self.bases.get(key, {}), ours, theirs, self.counters.get(key, ()))
+        # Update in place, since callers may be holding on to the dict.
+        ours.clear()
+        ours.update(merged)
+
+        self.versions[key] = version
+        # `ours` may go on to share nested values with `theirs`, so the base needs a copy that later changes to
+        #  our data cannot reach.
+        self.bases[key] = copy.deepcopy(theirs)
+
+    def write(self, key):
+        path = self.path_for(key)
+        with FileLock(path + '.lock'):
+            self.sync(key)
+            data = dict.__getitem__(self, key)
+            storage.write_json_atomic(path, data)
+            self.versions[key] = file_version(path)
+            self.bases[key] = copy.deepcopy(data)
+
+class LeaderElection:
+    """
+    Elects one process to run singleton jobs by having it hold an exclusive lock on a file. The operating system
+    releases the lock when the leader exits or dies, and another process takes over on its next attempt.
+    """
+
+    def __init__(self, path: str):
+        if fcntl is None:
+            raise RuntimeError('shared mode requires POSIX file locks')
+        self.path = path
+        self.file = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.file is not None
+
+    def try_acquire(self) -> bool:
+        if self.is_leader:
+            return True
+
+        file = open(self.path, 'a+')
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+
+        # Record who the leader is, for anyone looking at the directory.
+        file.seek(0)
+        file.truncate()
+        file.write(str(os.getpid()))
+        file.flush()
+        self.file = file
+        return True
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+    async def campaign(self, interval=5):
+        """ Keep trying to become the leader, so that we take over if the current one dies. """
+        while True:
+            if not self.is_leader and self.try_acquire():
+                logging.info(f'Process {os.getpid()} is now the leader.')
+            await asyncio.sleep(interval)
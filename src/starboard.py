@@ -0,0 +1,86 @@
+# Routing of reactions to starboards.
+#
+# Several boards can be configured, each with its own emoji, output channel and message map. Reaction
+#  payloads are routed through a table keyed by `(emoji, source channel ID)` that is rebuilt whenever the
+#  settings or the guild's channels change, so handling a reaction never has to look at every board.
+
+import discord.utils
+
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+from settings import DEFAULT_BOARD, Settings, StarboardSettings
+
+def select_for_archive(message_ids: Iterable[str], max_age_days=0, max_entries=0) -> List[str]:
+    """
+    Pick the IDs of messages that are older than `max_age_days`, then of the oldest remaining ones until at most
+    `max_entries` are left. Zero disables either limit.
+    """
+    # Message IDs are snowflakes, so they sort by the time the message was sent.
+    keys = sorted(message_ids, key=int)
+
+    selected = []
+    if max_age_days > 0:
+        cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+        selected = [k for k in keys if discord.utils.snowflake_time(int(k)) < cutoff]
+    if max_entries > 0:
+        remaining = keys[len(selected):]
+        selected += remaining[:max(0, len(remaining) - max_entries)]
+    return selected
+
+class Starboard:
+    """ One board's settings along with its resolved output channel. """
+
+    def __init__(self, name: str, settings: StarboardSettings, channel):
+        self.name = name
+        self.settings = settings
+        self.channel = channel
+
+    @property
+    def map_namespace(self) -> str:
+        """ The DB namespace mapping source message IDs to this board's posts. """
+        return 'message_map' if self.name == DEFAULT_BOARD else f'message_map__{self.name}'
+
+class Route:
+    def __init__(self, board: Starboard, threshold: int):
+        self.board = board
+        self.threshold = threshold
+
+class StarboardRouter:
+    def __init__(self, settings: Settings, find_channel: Callable[[str], object]):
+        self.boards: Dict[str, Starboard] = {}
+        # `(emoji, None)` holds a board's default route; `(emoji, channel_id)` holds an override, where a
+        #  route of `None` means the channel is excluded.
+        self.table: Dict[tuple, Optional[Route]] = {}
+
+        for name, board_settings in settings.boards.items():
+            if not board_settings.complete:
+                continue
+            board = Starboard(name, board_settings, find_channel(board_settings.channel))
+            self.boards[name] = board
+            self.table[(board_settings.emoji, None)] = Route(board, board_settings.threshold)
+
+            for channel_name, threshold in board_settings.channel_thresholds.items():
+                source = find_channel(channel_name)
+                if source is not None:
+                    self.table[(board_settings.emoji, source.id)] = Route(board, threshold)
+            for channel_name in board_settings.excluded_channels:
+                source = find_channel(channel_name)
+                if source is not None:
+                    self.table[(board_settings.emoji, source.id)] = None
+
+            # Never repost a board's own posts.
+            if board.channel is not None:
+                self.table[(board_settings.emoji, board.channel.id)] = None
+
+    def route(self, emoji: str, channel_id: int) -> Optional[Route]:
+        """ Find the board a reaction in a channel goes to, or None if it does not go to any. """
+        key = (emoji, channel_id)
+        if key in self.table:
+            return self.table[key]
+        return self.table.get((emoji, None))
+
+    def routes_for_channel(self, channel_id: int):
+        """ Every route that applies to messages in a channel. """
+        routes = (self.route(board.settings.emoji, channel_id) for board in self.boards.values())
+        return [r for r in routes if r is not None]
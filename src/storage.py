@@ -0,0 +1,313 @@
+# Storage helpers for the bot's JSON databases.
+#
+# Each database namespace lives in `local/{guild_id}/{name}.json`. Rather than
+#  reading every namespace at startup, `LazyDb` loads a namespace the first time
+#  it is looked up, so startup cost no longer scales with the largest file.
+
+import json
+import os
+
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+# Files larger than this are parsed incrementally instead of all at once.
+STREAM_THRESHOLD_BYTES = 1024 * 1024 * 4
+STREAM_CHUNK_SIZE = 1024 * 64
+
+# How many commas back from the end of the buffer to try splitting a batch of pairs at.
+_SPLIT_ATTEMPTS = 4
+
+class _NotFlat(Exception):
+    """ Raised by `iter_json_object` when the object looks like it has nested values. """
+    pass
+
+class LazyDb(dict):
+    """
+    A dict of database namespaces that are loaded on first access. The loader is called with the missing key
+    and is expected to store the loaded value in this dict itself before returning it.
+    """
+
+    def __init__(self, loader: Callable[[str], Any]):
+        super().__init__()
+        self.loader = loader
+
+    def __missing__(self, key):
+        return self.loader(key)
+
+    def is_loaded(self, key) -> bool:
+        return dict.__contains__(self, key)
+
+    def set_loaded(self, key, data, version):
+        """ Store a namespace that was just read from disk. `version` identifies the file it was read from. """
+        self[key] = data
+
+def iter_json_object(file, chunk_size=STREAM_CHUNK_SIZE) -> Iterator[Tuple[str, Any]]:
+    """
+    Yield the key/value pairs of a flat top-level JSON object, reading `file` in chunks so that only about one
+    chunk is held in memory as text. Each chunk is cut at its last comma and decoded as a batch. A cut inside
+    a string or nested value can never decode, so the last comma before the point where decoding failed is
+    tried instead, and the buffer grows if none works. Raises `_NotFlat` before yielding anything if the first chunk contains nested values.
+    """
+    buf = ''
+    while buf == '':
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        buf = chunk.lstrip()
+    if not buf.startswith('{'):
+        raise _NotFlat()
+    if '{' in buf[1:] or '[' in buf:
+        # Nested values are decoded faster in one go.
+        raise _NotFlat()
+    buf = buf[1:]
+    # Whether a batch has been split off at a comma, after which the object cannot end without another pair.
+    split = False
+
+    while True:
+        # Read at least as much as is already buffered, so a long value is re-scanned only a logarithmic
+        #  number of times.
+        chunk = file.read(max(chunk_size, len(buf)))
+        if not chunk:
+            if split and buf.lstrip().startswith('}'):
+                raise ValueError('Trailing comma in JSON object')
+            yield from json.loads('{' + buf).items()
+            return
+        buf += chunk
+
+        cut = buf.rfind(',')
+        for _ in range(_SPLIT_ATTEMPTS):
+            if cut <= 0:
+                break
+            try:
+                batch = json.loads('{' + buf[:cut] + '}')
+            except json.JSONDecodeError as e:
+                # Everything before the error decoded, so retry at the last comma before it. `e.pos` counts the
+                #  added brace.
+                cut = buf.rfind(',', 0, min(cut, e.pos - 1))
+                continue
+            yield from batch.items()
+            buf = buf[cut + 1:]
+            split = True
+            break
+
+def fill_defaults(data: dict, defaults: dict) -> List[str]:
+    """
+    Set keys that are missing from `data`, or whose value has the wrong type, to their defaults. A default of None
+    only fills in a missing key, since it stands for a value that is set later. Returns the keys that were set.
+    """
+    changed = []
+    for key, default in defaults.items():
+        if key not in data or (default is not None and type(data[key]) is not type(default)):
+            data[key] = default
+            changed.append(key)
+    return changed
+
+def read_json_file_versioned(path: str):
+    """
+    Read a database file, streaming it if it is large. Missing files are treated as empty. Also returns the version
+    of the file that was read, which changes whenever the file is replaced, or None if it does not exist.
+    """
+    if not os.path.exists(path):
+        return {}, None
+
+    with open(path, 'r', encoding='utf-8') as file:
+        # Stat the open file, since the path may be replaced while we are reading it.
+        stat = os.fstat(file.fileno())
+        version = [stat.st_ino, stat.st_mtime_ns]
+        if stat.st_size >= STREAM_THRESHOLD_BYTES:
+            try:
+                return dict(iter_json_object(file)), version
+            except _NotFlat:
+                file.seek(0)
+        return json.load(file), version
+
+def read_json_file(path: str) -> dict:
+    """ Read a database file, streaming it if it is large. Missing files are treated as empty. """
+    return read_json_file_versioned(path)[0]
+
+def write_json_atomic(path: str, data):
+    """ Write a file so that a crash leaves either the old or the new contents, never a partial file. """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+class Journal:
+    """
+    An append-only log of key-level changes to DB namespaces. Changes are logged here instead of rewriting the
+    whole namespace file, and the files are brought up to date when the journal is compacted. A `written` record
+    marks a namespace as having been written in full, so any changes to it before that point are skipped on replay.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def read(self) -> Dict[str, List[dict]]:
+        """ Get the changes that still need to be applied to each namespace, in order. """
+        pending = {}
+        if not os.path.exists(self.path):
+            return pending
+
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line may have been cut off by a crash.
+                    break
+                if record['op'] == 'written':
+                    pending.pop(record['ns'], None)
+                else:
+                    pending.setdefault(record['ns'], []).append(record)
+        return pending
+
+    def append(self, record: dict):
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def truncate(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def apply_journal_records(data: dict, records: List[dict]):
+    for record in records:
+        if record['op'] == 'set':
+            data[record['key']] = record['value']
+        elif record['op'] == 'delete':
+            data.pop(record['key'], None)
+
+class Archive:
+    """
+    Cold storage for entries moved out of a namespace: a JSON lines file that entries are appended to, with an
+    in-memory index of where each key's latest line starts, so a lookup reads a single line. The index is built on
+    first use and extended as the file grows, including by other processes. Removing an entry appends a tombstone,
+    and `compact` rewrites the file with only the live entries.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index: Dict[str, int] = {}
+        # Lines in the file that no longer hold a live entry.
+        self.dead_lines = 0
+        self.indexed_size = 0
+        self.inode = None
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+        if stat is None or stat.st_ino != self.inode or stat.st_size < self.indexed_size:
+            # The file was replaced, so start over.
+            self.index.clear()
+            self.dead_lines = 0
+            self.indexed_size = 0
+            self.inode = stat.st_ino if stat is not None else None
+        if stat is None or stat.st_size == self.indexed_size:
+            return
+
+        with open(self.path, 'rb') as file:
+            file.seek(self.indexed_size)
+            offset = self.indexed_size
+            for line in file:
+                if not line.endswith(b'\n'):
+                    # Still being written; index it next time.
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if record is None:
+                    self.dead_lines += 1
+                elif record.get('removed', False):
+                    self.dead_lines += 1 + (record['key'] in self.index)
+                    self.index.pop(record['key'], None)
+                else:
+                    self.dead_lines += record['key'] in self.index
+                    self.index[record['key']] = offset
+                offset += len(line)
+            self.indexed_size = offset
+
+    def _append_lines(self, records):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._refresh()
+        with open(self.path, 'ab') as file:
+            # A crash may have left part of a line at the end, which our lines must not be joined onto.
+            prefix = b'\n' if file.tell() > self.indexed_size else b''
+            file.write(prefix + b''.join(json.dumps(record).encode('utf-8') + b'\n' for record in records))
+            file.flush()
+            os.fsync(file.fileno())
+        self._refresh()
+
+    def append(self, entries: dict):
+        """ Move entries to cold storage. """
+        self._append_lines({'key': key, 'value': value} for key, value in entries.items())
+
+    def get(self, key):
+        """ Look up an entry, returning the most recently archived value or None. """
+        self._refresh()
+        if key not in self.index:
+            return None
+        with open(self.path, 'rb') as file:
+            file.seek(self.index[key])
+            return json.loads(file.readline())['value']
+
+    def __contains__(self, key):
+        self._refresh()
+        return key in self.index
+
+    def __len__(self):
+        self._refresh()
+        return len(self.index)
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """ Every live entry, in the order they were archived. This reads the whole file, so keep it off hot paths. """
+        self._refresh()
+        offsets = sorted((offset, key) for key, offset in self.index.items())
+        if len(offsets) == 0:
+            return
+        with open(self.path, 'rb') as file:
+            for offset, key in offsets:
+                file.seek(offset)
+                yield key, json.loads(file.readline())['value']
+
+    def remove(self, keys: List[str]):
+        """ Drop entries, e.g. once they have been moved back into their namespace. """
+        self._refresh()
+        keys = [key for key in keys if key in self.index]
+        if len(keys) > 0:
+            self._append_lines({'key': key, 'removed': True} for key in keys)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._refresh()
+
+    @property
+    def needs_compaction(self) -> bool:
+        """ Whether enough of the file is dead lines that it is worth rewriting. """
+        return self.dead_lines > 0 and self.dead_lines >= len(self.index)
+
+    def compact(self):
+        """ Rewrite the file with only the live entries. """
+        self._refresh()
+        if self.dead_lines == 0:
+            return
+
+        temp_path = self.path + '.tmp'
+        with open(self.path, 'rb') as source, open(temp_path, 'wb') as file:
+            for offset in sorted(self.index.values()):
+                source.seek(offset)
+                file.write(source.readline())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+        self._refresh()
@@ -0,0 +1,56 @@
+import logging
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import storage
+
+class FakeBot:
+    """ Stands in for `Starbot` with an in-memory DB, since importing `bot` starts the bot. """
+
+    def __init__(self, tmp_path, db=None):
+        self.tmp_path = tmp_path
+        self.db = db if db is not None else {}
+        self.written = []
+        self.dirty = set()
+        self.archives = {}
+        self.restored_state = {}
+        self.starboards = None
+        self.guild_id = 1
+
+    def db_load_name(self, name):
+        return self.db.setdefault(name, {})
+
+    def db_write_name(self, name):
+        self.written.append(name)
+        self.dirty.discard(name)
+
+    def db_mark_dirty(self, name):
+        self.dirty.add(name)
+
+    def db_register_counters(self, name, paths):
+        pass
+
+    def cog_db(self, name):
+        import bot_cog
+        return bot_cog.CogDb(self, name)
+
+    def archive(self, name):
+        if name not in self.archives:
+            self.archives[name] = storage.Archive(str(self.tmp_path / 'archive' / f'{name}.jsonl'))
+        return self.archives[name]
+
+@pytest.fixture
+def fake_bot_module(monkeypatch):
+    """ Lets modules that import from `bot` be imported, by giving them a stand-in module. """
+    monkeypatch.setitem(sys.modules, 'bot', types.SimpleNamespace(Starbot=FakeBot, logging=logging))
+    for name in [n for n in sys.modules if n == 'bot_cog' or n == 'cogs' or n.startswith('cogs.')]:
+        monkeypatch.delitem(sys.modules, name)
+
+@pytest.fixture
+def fake_bot(tmp_path, fake_bot_module):
+    return FakeBot(tmp_path)
@@ -0,0 +1,15 @@
+import pytest
+
+pytest.importorskip('discord')
+
+def test_last_tick_survives_cog_construction(fake_bot):
+    import bot_cog
+
+    stored = {'members': {}, 'scoreboard_message_id': 1234, 'last_tick': '2026-01-01 00:00:00'}
+    fake_bot.db['cog__Tracker'] = dict(stored)
+
+    class Tracker(bot_cog.StarbotCog):
+        pass
+
+    Tracker(fake_bot, {'members': dict(), 'scoreboard_message_id': None, 'last_tick': None})
+    assert fake_bot.db['cog__Tracker'] == stored
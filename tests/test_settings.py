@@ -0,0 +1,106 @@
+import pytest
+
+from settings import (ExtraStarboardSettings, Settings, SettingsError, SettingsManager, coerce, setting_type)
+
+class FakeBot:
+    def __init__(self, tmp_path, raw):
+        self.tmp_path = tmp_path
+        self.db = {'settings': raw}
+        self.written = []
+
+    def db_path(self, name):
+        return str(self.tmp_path / f'{name}.json')
+
+    def db_write_name(self, name):
+        self.written.append(name)
+
+def test_coerce_bool():
+    assert coerce(bool, 'false') is False
+    assert coerce(bool, 'Yes') is True
+    with pytest.raises(SettingsError):
+        coerce(bool, 'maybe')
+
+def test_coerce_list():
+    assert coerce(setting_type('starboard.excluded_channels'), 'a, b,,c') == ('a', 'b', 'c')
+
+def test_bool_is_not_an_int():
+    with pytest.raises(SettingsError):
+        Settings.from_dict({'starboard': {'threshold': True}})
+    with pytest.raises(SettingsError):
+        Settings.from_dict({'starboard': {'threshold': 5.0}})
+
+def test_setting_type_mapping_paths():
+    assert setting_type('starboard.channel_thresholds.general') is int
+    assert setting_type('starboards.hall.emoji') is str
+    assert setting_type('memory.namespace_budgets_kb.message_map') is int
+    # Whole objects and mappings cannot be set at once.
+    assert setting_type('starboards.hall') is None
+    assert setting_type('starboard') is None
+    assert setting_type('starboard.nope') is None
+
+def test_extra_boards_need_emoji_and_channel():
+    settings = Settings.from_dict({'starboards': {'hall': {'emoji': '💀'}}})
+    assert isinstance(settings.starboards['hall'], ExtraStarboardSettings)
+    assert not settings.starboards['hall'].complete
+    assert settings.starboard.complete
+
+@pytest.mark.parametrize('raw', [
+    {'starboards': {'starboard': {}}},
+    {'starboards': {'../x': {}}},
+    {'starboards': {'hall': {'emoji': '⭐', 'channel': 'hall'}}},
+    {'starboard': {'threshold': 0}},
+])
+def test_invalid_settings(raw):
+    with pytest.raises(SettingsError):
+        Settings.from_dict(raw)
+
+def test_round_trip():
+    raw = {'starboard': {'channel_thresholds': {'general': 3}}, 'starboards': {'hall': {'emoji': '💀', 'channel': 'hall'}}}
+    settings = Settings.from_dict(raw)
+    assert Settings.from_dict(settings.to_dict()) == settings
+
+def test_set_notifies_subscribers(tmp_path):
+    bot = FakeBot(tmp_path, {})
+    manager = SettingsManager(bot)
+    seen = []
+    manager.subscribe(seen.append)
+
+    manager.set('starboard.threshold', '3')
+    assert manager.current.starboard.threshold == 3
+    assert bot.db['settings'] == {'starboard': {'threshold': 3}}
+    assert bot.written == ['settings']
+    assert [s.starboard.threshold for s in seen] == [5, 3]
+
+def test_set_rolls_back_on_invalid_value(tmp_path):
+    bot = FakeBot(tmp_path, {'starboard': {'threshold': 4}})
+    manager = SettingsManager(bot)
+    seen = []
+    manager.subscribe(seen.append)
+
+    with pytest.raises(SettingsError):
+        manager.set('starboard.threshold', '0')
+    with pytest.raises(SettingsError):
+        manager.set('starboard.threshold', 'many')
+    with pytest.raises(SettingsError):
+        manager.set('starboard.nope', '1')
+
+    assert bot.db['settings'] == {'starboard': {'threshold': 4}}
+    assert manager.current.starboard.threshold == 4
+    assert bot.written == []
+    assert len(seen) == 1
+
+def test_invalid_file_falls_back_to_defaults(tmp_path):
+    bot = FakeBot(tmp_path, {'starboard': {'threshold': 5.0}})
+    manager = SettingsManager(bot)
+    assert manager.current == Settings()
+    # The file is kept so the bad value can be fixed.
+    assert bot.db['settings'] == {'starboard': {'threshold': 5.0}}
+    manager.set('starboard.threshold', '5')
+    assert manager.current.starboard.threshold == 5
+
+def test_reload_keeps_snapshot_on_invalid_file(tmp_path):
+    bot = FakeBot(tmp_path, {})
+    bot.db_read_name = lambda name: {'starboard': {'threshold': 'five'}}
+    manager = SettingsManager(bot)
+    manager.reload()
+    assert manager.current == Settings()
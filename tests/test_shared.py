@@ -0,0 +1,187 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+
+import shared
+import storage
+
+# Holds a lease's lock in another process until it is killed.
+LEASE_HOLDER = '''
+import fcntl, sys, time
+file = open(sys.argv[1], 'a')
+fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+print('held', flush=True)
+time.sleep(60)
+'''
+
+def make_db(tmp_path):
+    def path_for(key):
+        return str(tmp_path / f'{key}.json')
+    db = None
+    def loader(key):
+        db.set_loaded(key, *storage.read_json_file_versioned(path_for(key)))
+        return dict.__getitem__(db, key)
+    db = shared.SharedDb(loader, path_for)
+    return db
+
+@pytest.fixture
+def processes(tmp_path):
+    storage.write_json_atomic(str(tmp_path / 'qi.json'), {'a': ['1'], 'b': ['2']})
+    return make_db(tmp_path), make_db(tmp_path)
+
+def test_sync_then_in_place_change_is_not_lost(processes, tmp_path):
+    a, b = processes
+    a['qi'], b['qi']
+
+    # B writes, and A picks the change up.
+    b['qi']['b'].append('3')
+    b.write('qi')
+    a.sync('qi')
+
+    # A changes a list that it now shares with what it last saw on disk, then B writes again.
+    a['qi']['a'].append('4')
+    b['qi']['c'] = ['5']
+    b.write('qi')
+    a.write('qi')
+
+    assert storage.read_json_file(str(tmp_path / 'qi.json')) == {'a': ['1', '4'], 'b': ['2', '3'], 'c': ['5']}
+
+def test_merge_keys_top_level():
+    base = {'a': 1, 'b': 2, 'c': 3}
+    ours = {'a': 10, 'b': 2, 'd': 4}
+    theirs = {'a': 1, 'b': 20, 'c': 3, 'e': 5}
+    assert shared.merge_keys(base, ours, theirs) == {'a': 10, 'b': 20, 'd': 4, 'e': 5}
+
+def test_merge_keys_nested():
+    base = {'boards': {'starboard': {'counts': {'1': 5}, 'days': {'d1': 5}}}}
+    ours = {'boards': {'starboard': {'counts': {'1': 6}, 'days': {'d1': 6}}}}
+    theirs = {'boards': {'starboard': {'counts': {'1': 5, '2': 5}, 'days': {'d1': 10}}, 'hall': {'counts': {}}}}
+    assert shared.merge_keys(base, ours, theirs) == {
+        'boards': {'starboard': {'counts': {'1': 6, '2': 5}, 'days': {'d1': 6}}, 'hall': {'counts': {}}}
+    }
+
+def test_merge_keys_nested_delete_and_add():
+    base = {'members': {'1': {'points': 1}, '2': {'points': 2}}}
+    ours = {'members': {'2': {'points': 2}}, 'new': {'x': 1}}
+    theirs = {'members': {'1': {'points': 1}, '2': {'points': 3}, '3': {'points': 1}}, 'new': {'y': 2}}
+    assert shared.merge_keys(base, ours, theirs) == {
+        'members': {'2': {'points': 3}, '3': {'points': 1}}, 'new': {'x': 1, 'y': 2}
+    }
+
+def test_merge_keys_non_object_changes_take_ours():
+    base = {'list': [1], 'value': {'a': 1}}
+    ours = {'list': [1, 2], 'value': 7}
+    theirs = {'list': [1, 3], 'value': {'a': 1, 'b': 2}}
+    assert shared.merge_keys(base, ours, theirs) == {'list': [1, 2], 'value': 7}
+
+def test_concurrent_nested_writes_are_kept(tmp_path):
+    storage.write_json_atomic(str(tmp_path / 'stats.json'), {'boards': {'starboard': {'counts': {}}}})
+    a, b = make_db(tmp_path), make_db(tmp_path)
+    a['stats']['boards']['starboard']['counts']['1'] = 5
+    b['stats']['boards']['starboard']['counts']['2'] = 7
+    a.write('stats')
+    b.write('stats')
+    assert storage.read_json_file(str(tmp_path / 'stats.json')) == {'boards': {'starboard': {'counts': {'1': 5, '2': 7}}}}
+
+def test_key_lease_is_exclusive(tmp_path):
+    path = str(tmp_path / '1.lock')
+    first, second = shared.KeyLease(path), shared.KeyLease(path)
+    assert first.try_acquire()
+    assert not second.try_acquire()
+    first.release()
+    assert not os.path.exists(path)
+    assert second.try_acquire()
+    second.release()
+
+def test_key_lease_serializes_tasks(tmp_path):
+    path = str(tmp_path / '1.lock')
+    posts = []
+
+    async def update(name):
+        async with shared.KeyLease(path, interval=0.01):
+            # Check and create, with an await between them like sending a message.
+            if len(posts) == 0:
+                await asyncio.sleep(0.05)
+                posts.append(name)
+
+    async def main():
+        await asyncio.gather(*(update(i) for i in range(5)))
+
+    asyncio.run(main())
+    assert len(posts) == 1
+
+def test_key_lease_excludes_other_processes(tmp_path):
+    path = str(tmp_path / '1.lock')
+    holder = subprocess.Popen([sys.executable, '-c', LEASE_HOLDER, path], stdout=subprocess.PIPE)
+    try:
+        assert holder.stdout.readline().strip() == b'held'
+        assert not shared.KeyLease(path).try_acquire()
+    finally:
+        holder.kill()
+        holder.wait()
+    # The lock goes away with the process that held it.
+    lease = shared.KeyLease(path)
+    assert lease.try_acquire()
+    lease.release()
+
+def test_event_claims_once(tmp_path):
+    ours, theirs = shared.EventClaims(str(tmp_path)), shared.EventClaims(str(tmp_path))
+    assert ours.claim('message.1')
+    assert not theirs.claim('message.1')
+    assert theirs.claim('message.2')
+
+def test_event_claims_toggle(tmp_path):
+    ours, theirs = shared.EventClaims(str(tmp_path)), shared.EventClaims(str(tmp_path))
+    # Each event is received by both processes, and only the first to see it handles it.
+    handled = []
+    for state in ['add', 'remove', 'add']:
+        handled += [name for name, claims in [('ours', ours), ('theirs', theirs)] if claims.claim_toggle('r.1.2', state)]
+    assert len(handled) == 3
+
+def test_event_claims_expire(tmp_path):
+    claims = shared.EventClaims(str(tmp_path))
+    claims.claim('old')
+    claims.claim('new')
+    os.utime(str(tmp_path / 'old'), (0, 0))
+    claims.expire(60)
+    assert sorted(os.listdir(str(tmp_path))) == ['new']
+    assert claims.claim('old')
+
+COUNTERS = [('boards', '*', 'authors', '*'), ('boards', '*', 'days', '*')]
+
+def test_merge_keys_counters():
+    base = {'boards': {'s': {'authors': {'a': 10, 'b': 2, 'c': 4}, 'days': {'d1': 10}, 'counts': {'1': 5}}}}
+    ours = {'boards': {'s': {'authors': {'a': 15, 'c': 4, 'new': 1}, 'days': {'d1': 15, 'd2': 1}, 'counts': {'1': 6}}}}
+    theirs = {'boards': {'s': {'authors': {'a': 13, 'b': 2, 'new': 2}, 'days': {'d1': 13, 'd2': 2}, 'counts': {'1': 7}}}}
+    assert shared.merge_keys(base, ours, theirs, COUNTERS) == {
+        # `b` dropped to 0 on our side, and they removed `c`.
+        'boards': {'s': {'authors': {'a': 18, 'new': 3}, 'days': {'d1': 18, 'd2': 3}, 'counts': {'1': 6}}}
+    }
+
+def test_merge_keys_counters_ignore_other_paths():
+    base = {'members': {'1': {'score': 1}}, 'message_id': 100}
+    ours = {'members': {'1': {'score': 2}}, 'message_id': 200}
+    theirs = {'members': {'1': {'score': 3}}, 'message_id': 300}
+    assert shared.merge_keys(base, ours, theirs, COUNTERS) == ours
+
+def test_concurrent_counter_increments_are_kept(tmp_path):
+    storage.write_json_atomic(str(tmp_path / 'stats.json'), {'boards': {'s': {'days': {'d1': 10}, 'authors': {}}}})
+    a, b = make_db(tmp_path), make_db(tmp_path)
+    for db in (a, b):
+        db.counters['stats'] = COUNTERS
+        db['stats']
+    a['stats']['boards']['s']['days']['d1'] += 5
+    a['stats']['boards']['s']['authors']['x'] = 5
+    b['stats']['boards']['s']['days']['d1'] += 3
+    b['stats']['boards']['s']['authors']['x'] = 3
+    a.write('stats')
+    b.write('stats')
+    # Syncing again does not count anything twice.
+    a.sync('stats')
+    a.write('stats')
+    expected = {'boards': {'s': {'days': {'d1': 18}, 'authors': {'x': 8}}}}
+    assert storage.read_json_file(str(tmp_path / 'stats.json')) == expected
+    assert a['stats'] == expected
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+from settings import Settings
+from starboard import StarboardRouter
+
+CHANNELS = {name: SimpleNamespace(id=i, name=name)
+            for i, name in enumerate(['starboard', 'hall', 'general', 'memes', 'serious'], start=1)}
+
+def find_channel(name):
+    return CHANNELS.get(name)
+
+def make_router(raw):
+    return StarboardRouter(Settings.from_dict(raw), find_channel)
+
+def route_to(router, emoji, channel):
+    route = router.route(emoji, CHANNELS[channel].id)
+    return None if route is None else (route.board.name, route.threshold)
+
+RAW = {
+    'starboard': {'threshold': 5, 'channel_thresholds': {'memes': 10, 'missing': 2}, 'excluded_channels': ['serious']},
+    'starboards': {
+        'hall': {'emoji': '💀', 'channel': 'hall', 'threshold': 3},
+        'draft': {'emoji': '🔥'},
+    },
+}
+
+def test_default_routes():
+    router = make_router(RAW)
+    assert route_to(router, '⭐', 'general') == ('starboard', 5)
+    assert route_to(router, '💀', 'general') == ('hall', 3)
+    assert route_to(router, '👍', 'general') is None
+
+def test_overrides_and_exclusions():
+    router = make_router(RAW)
+    assert route_to(router, '⭐', 'memes') == ('starboard', 10)
+    assert route_to(router, '⭐', 'serious') is None
+    # Overrides only apply to the board they are configured on.
+    assert route_to(router, '💀', 'memes') == ('hall', 3)
+    assert route_to(router, '💀', 'serious') == ('hall', 3)
+
+def test_boards_own_channel_is_skipped():
+    router = make_router(RAW)
+    assert route_to(router, '⭐', 'starboard') is None
+    assert route_to(router, '💀', 'hall') is None
+    # Another board may still pick up posts from a board's channel.
+    assert route_to(router, '💀', 'starboard') == ('hall', 3)
+
+def test_incomplete_boards_are_not_routed():
+    router = make_router(RAW)
+    assert 'draft' not in router.boards
+    assert route_to(router, '🔥', 'general') is None
+
+def test_missing_board_channel():
+    router = make_router({'starboards': {'gone': {'emoji': '💤', 'channel': 'nowhere'}}})
+    assert router.boards['gone'].channel is None
+    assert route_to(router, '💤', 'general') == ('gone', 5)
+
+def test_routes_for_channel():
+    router = make_router(RAW)
+    assert sorted(r.board.name for r in router.routes_for_channel(CHANNELS['general'].id)) == ['hall', 'starboard']
+    assert [r.board.name for r in router.routes_for_channel(CHANNELS['serious'].id)] == ['hall']
+    assert [r.board.name for r in router.routes_for_channel(CHANNELS['hall'].id)] == ['starboard']
+
+def test_map_namespaces():
+    router = make_router(RAW)
+    assert router.boards['starboard'].map_namespace == 'message_map'
+    assert router.boards['hall'].map_namespace == 'message_map__hall'
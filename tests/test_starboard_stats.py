@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('discord')
+
+@pytest.fixture
+def stats_module(fake_bot_module):
+    from cogs import starboard_stats
+    return starboard_stats
+
+@pytest.fixture
+def stats(stats_module, fake_bot):
+    return stats_module.StarboardStats(fake_bot, logging)
+
+def message(message_id, author_id, channel_id=9):
+    return SimpleNamespace(id=message_id, author=SimpleNamespace(id=author_id), channel=SimpleNamespace(id=channel_id))
+
+class Context:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, text):
+        self.sent.append(text)
+
+def test_ranked_scores_top_order(stats_module):
+    ranked = stats_module.RankedScores({'a': 3, 'b': 7, 'c': 5})
+    assert ranked.top(2) == [('b', 7), ('c', 5)]
+    # Reading the top does not use it up.
+    assert ranked.top(5) == [('b', 7), ('c', 5), ('a', 3)]
+
+def test_ranked_scores_updates(stats_module):
+    scores = {'a': 3, 'b': 7}
+    ranked = stats_module.RankedScores(scores)
+    ranked.set('a', 10)
+    ranked.add('b', -7)
+    ranked.add('c', 1)
+    assert scores == {'a': 10, 'c': 1}
+    assert ranked.top(3) == [('a', 10), ('c', 1)]
+
+def test_ranked_scores_prunes_stale_entries(stats_module):
+    ranked = stats_module.RankedScores({})
+    for i in range(1000):
+        ranked.set(str(i % 10), i)
+        assert len(ranked.heap) <= 2 * len(ranked.scores) + 65
+    assert ranked.top(3) == [('9', 999), ('8', 998), ('7', 997)]
+
+def test_record_and_remove_deltas(stats, fake_bot):
+    today = str(datetime.utcnow().date())
+    writes = len(fake_bot.written)
+    stats.record('starboard', message(1, 100), 5)
+    stats.record('starboard', message(2, 100), 6)
+    stats.record('starboard', message(1, 100), 8)
+    data = stats.board_data('starboard')
+    assert data['counts'] == {'1': 8, '2': 6}
+    assert data['authors'] == {'100': 14}
+    assert data['days'] == {today: 14}
+    assert data['entries']['1'] == ['100', '9']
+
+    stats.remove('starboard', 1)
+    stats.remove('starboard', 1)
+    assert data['counts'] == {'2': 6}
+    assert '1' not in data['entries']
+    assert data['authors'] == {'100': 6}
+    assert data['days'] == {today: 6}
+
+    # Changes wait for compaction instead of being written each time.
+    assert fake_bot.dirty == {'cog__StarboardStats'}
+    assert len(fake_bot.written) == writes
+
+def test_unknown_board_is_not_created(stats, fake_bot):
+    ctx = Context()
+    asyncio.run(stats.starstats_authors.callback(stats, ctx, 10, 'typo'))
+    asyncio.run(stats.starstats_velocity.callback(stats, ctx, 7, 'typo'))
+    assert 'typo' not in fake_bot.db['cog__StarboardStats']['boards']
+    assert ctx.sent == ['I do not have a board called "typo".'] * 2
+
+class Channel:
+    def __init__(self, channel_id, messages):
+        self.id = channel_id
+        self.messages = messages
+
+    async def fetch_message(self, message_id):
+        return self.messages[message_id]
+
+def test_rebuild_includes_archived_entries(stats, fake_bot):
+    source = Channel(9, {})
+    posts = Channel(5, {})
+    for message_id, post_id, stars in [(1, 101, 5), (2, 102, 7)]:
+        source.messages[message_id] = SimpleNamespace(
+            id=message_id, author=SimpleNamespace(id=100), channel=source, created_at=datetime(2026, 1, 1),
+            reactions=[SimpleNamespace(emoji='⭐', count=stars)])
+        posts.messages[post_id] = SimpleNamespace(embeds=[SimpleNamespace(
+            description=f'**[Jump](https://discord.com/channels/1/9/{message_id})**')])
+
+    board = SimpleNamespace(name='starboard', channel=posts, map_namespace='message_map',
+                            settings=SimpleNamespace(emoji='⭐'))
+    fake_bot.starboards = SimpleNamespace(boards={'starboard': board})
+    fake_bot.guild = SimpleNamespace(get_channel=lambda channel_id: source)
+    fake_bot.is_leader = True
+    fake_bot.db['message_map'] = {'1': 101}
+    fake_bot.archive('message_map').append({'2': 102})
+
+    asyncio.run(stats.starstats_rebuild.callback(stats, Context()))
+    data = stats.board_data('starboard')
+    assert data['counts'] == {'1': 5, '2': 7}
+    assert data['authors'] == {'100': 12}
+    assert data['days'] == {'2026-01-01': 12}
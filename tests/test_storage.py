@@ -0,0 +1,143 @@
+import io
+import json
+import random
+
+import pytest
+
+import storage
+
+def random_flat_map(count):
+    rng = random.Random(count)
+    values = [lambda: rng.randint(0, 10**18), lambda: 'a "quoted", comma: }', lambda: None, lambda: True,
+              lambda: -2.25e-7, lambda: 'x' * rng.randint(0, 300)]
+    return {str(rng.randint(0, 10**18)): rng.choice(values)() for _ in range(count)}
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, 4096])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_iter_json_object_chunk_boundaries(chunk_size, indent):
+    data = random_flat_map(500)
+    text = json.dumps(data, indent=indent)
+    assert dict(storage.iter_json_object(io.StringIO(text), chunk_size)) == data
+
+@pytest.mark.parametrize('text', ['{}', ' { } ', '{"a": 1}', '{"a": ",,,"}'])
+def test_iter_json_object_small(text):
+    assert dict(storage.iter_json_object(io.StringIO(text), 1)) == json.loads(text)
+
+@pytest.mark.parametrize('text', ['{"a": 1,}', '{"a": 1,,"b": 2}', '{"a": 1'])
+def test_iter_json_object_invalid(text):
+    with pytest.raises(ValueError):
+        dict(storage.iter_json_object(io.StringIO(text), 2))
+
+def test_iter_json_object_rejects_nested():
+    with pytest.raises(storage._NotFlat):
+        next(storage.iter_json_object(io.StringIO('{"members": {"a": 1}}')))
+
+def test_read_json_file_large_nested(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'STREAM_THRESHOLD_BYTES', 16)
+    data = {'members': {str(i): {'score': i} for i in range(100)}, 'other': None}
+    path = tmp_path / 'db.json'
+    path.write_text(json.dumps(data))
+    assert storage.read_json_file(str(path)) == data
+
+def test_read_json_file_large_flat(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'STREAM_THRESHOLD_BYTES', 16)
+    data = random_flat_map(1000)
+    path = tmp_path / 'db.json'
+    path.write_text(json.dumps(data))
+    assert storage.read_json_file(str(path)) == data
+
+def decoded_length(monkeypatch, text, chunk_size=storage.STREAM_CHUNK_SIZE):
+    """ Stream `text` and return the total length of the text handed to `json.loads`. """
+    decoded = []
+    loads = json.loads
+
+    def counting_loads(s, *args, **kwargs):
+        decoded.append(len(s))
+        return loads(s, *args, **kwargs)
+
+    monkeypatch.setattr(storage.json, 'loads', counting_loads)
+    assert dict(storage.iter_json_object(io.StringIO(text), chunk_size)) == loads(text)
+    return sum(decoded)
+
+def test_iter_json_object_decodes_flat_map_once(monkeypatch):
+    text = json.dumps({str(10**17 + i): 10**17 + i for i in range(20000)})
+    assert decoded_length(monkeypatch, text, 4096) < len(text) * 1.1
+
+def test_iter_json_object_long_value_is_not_quadratic(monkeypatch):
+    # A single value spanning many chunks must not be re-decoded once per chunk.
+    text = json.dumps({'a': 'x' * (1024 * 1024), 'b': 1})
+    assert decoded_length(monkeypatch, text, 4096) < len(text) * 3
+
+def test_iter_json_object_commas_in_values_are_not_rescanned(monkeypatch):
+    text = json.dumps({str(i): 'a, "b", c' * 50 for i in range(2000)})
+    assert decoded_length(monkeypatch, text, 4096) < len(text) * 3
+
+def test_archive_lookup_and_remove(tmp_path):
+    archive = storage.Archive(str(tmp_path / 'archive' / 'ns.jsonl'))
+    assert archive.get('1') is None
+    archive.append({'1': 'a', '2': {'b': [1]}})
+    archive.append({'1': 'c'})
+    assert archive.get('1') == 'c'
+    assert archive.get('2') == {'b': [1]}
+
+    archive.remove(['1', 'missing'])
+    assert archive.get('1') is None
+    assert archive.get('2') == {'b': [1]}
+
+def test_archive_sees_appends_from_other_instances(tmp_path):
+    path = str(tmp_path / 'ns.jsonl')
+    ours, theirs = storage.Archive(path), storage.Archive(path)
+    ours.append({'1': 'a'})
+    assert theirs.get('1') == 'a'
+    theirs.append({'2': 'b'})
+    theirs.compact()
+    assert ours.get('2') == 'b'
+
+def test_archive_compact_keeps_live_entries(tmp_path):
+    path = tmp_path / 'ns.jsonl'
+    archive = storage.Archive(str(path))
+    archive.append({str(i): i for i in range(10)})
+    archive.remove([str(i) for i in range(8)])
+    archive.append({'9': 'new'})
+    assert archive.needs_compaction
+
+    archive.compact()
+    assert not archive.needs_compaction
+    assert len(path.read_text().splitlines()) == 2
+    assert storage.Archive(str(path)).get('8') == 8
+    assert archive.get('9') == 'new'
+
+def test_archive_ignores_partial_last_line(tmp_path):
+    path = tmp_path / 'ns.jsonl'
+    path.write_text('{"key": "1", "value": 1}\n{"key": "2", "val')
+    archive = storage.Archive(str(path))
+    assert archive.get('1') == 1
+    assert archive.get('2') is None
+
+def test_archive_append_after_partial_last_line(tmp_path):
+    path = tmp_path / 'ns.jsonl'
+    path.write_text('{"key": "1", "value": 1}\n{"key": "2", "val')
+    archive = storage.Archive(str(path))
+    archive.append({'3': 3})
+    assert archive.get('1') == 1
+    assert archive.get('3') == 3
+    assert storage.Archive(str(path)).get('3') == 3
+
+def test_fill_defaults_keeps_values_set_later():
+    data = {'last_tick': '2026-01-01 00:00:00', 'members': [], 'scoreboard_message_id': 1234}
+    changed = storage.fill_defaults(data, {'members': {}, 'scoreboard_message_id': None, 'last_tick': None, 'new': 0})
+    assert sorted(changed) == ['members', 'new']
+    assert data == {'last_tick': '2026-01-01 00:00:00', 'members': {}, 'scoreboard_message_id': 1234, 'new': 0}
+
+def test_archive_items_and_contains(tmp_path):
+    archive = storage.Archive(str(tmp_path / 'ns.jsonl'))
+    assert list(archive.items()) == []
+    assert len(archive) == 0
+    archive.append({'1': 'a', '2': 'b'})
+    archive.append({'1': 'c'})
+    archive.remove(['2'])
+    archive.append({'3': 'd'})
+    assert list(archive.items()) == [('1', 'c'), ('3', 'd')]
+    assert '1' in archive
+    assert '2' not in archive
+    assert len(archive) == 2